@@ -0,0 +1,327 @@
+r"""
+ ____  _                           ____
+|  _ \(_) __ _ _ __   __ _  ___   / ___| _   _  __ _  __ _ _ __
+| | | | |/ _` | '_ \ / _` |/ _ \  \___ \| | | |/ _` |/ _` | '__|
+| |_| | | (_| | | | | (_| | (_) |  ___) | |_| | (_| | (_| | |
+|____// |\__,_|_| |_|\__, |\___/  |____/ \__,_|\__, |\__,_|_|
+    |__/             |___/                     |___/
+
+    https://github.com/yingzhuo/django-sugar
+
+"""
+import json
+import logging
+import os
+import re
+import time
+from collections import deque
+from concurrent import futures
+
+from django_sugar import lang
+from django_sugar.web import pwd_encoder
+
+_IDENTIFIER_REGEX = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)?$')
+
+# 可以还原出密码原文的算法
+_REVERSIBLE_ALGORITHMS = {
+    'noop': lambda x: x,
+    'base64': lang.base64_urlsafe_decode,
+    'reverse': lambda x: x[::-1],
+}
+
+
+class PasswordMigration(object):
+    """
+    批量迁移密码密文
+
+    两种模式:
+        rewrap  用慢哈希包装旧的快速哈希, 例如 '{md5}xxx' -> '{bcrypt_md5}...', 不需要密码原文
+        rehash  还原可逆的密文 (noop/base64/reverse) 后用目标算法重新加密, 例如 '{noop}xxx' -> '{bcrypt}...'
+
+    按主键分段读取 (WHERE id > ? ORDER BY id LIMIT ?), 不持有长时间打开的游标,
+    计算在进程池中进行, 结果以executemany分批写回, 每批一个事务。
+    每批提交后将进度写入检查点文件, 中断后再次运行会从检查点继续。
+
+    写回时以旧的密文为条件, 迁移期间被用户修改过的密码不会被覆盖。
+
+    例如:
+
+    import sqlite3
+    conn = sqlite3.connect('db.sqlite3')
+    PasswordMigration(conn, table='auth_user', source_algorithms=['md5', 'sha1'],
+                      checkpoint_path='migration.json').run()
+    """
+
+    def __init__(self, connection, *, table, id_column='id', password_column='password', mode='rewrap',
+                 source_algorithms=('md5', 'sha1'), target_algorithm='bcrypt', chunk_size=1000, batch_size=500,
+                 max_workers=None, checkpoint_path=None, log_interval=5.0, paramstyle=None):
+        """
+        构造方法
+
+        :param connection: DB-API连接, 例如sqlite3.Connection或django.db.connection
+        :param table: 表名
+        :param id_column: 主键列名, 主键必须可以排序
+        :param password_column: 密码列名
+        :param mode: 'rewrap' 或 'rehash'
+        :param source_algorithms: 要迁移的算法名称列表
+        :param target_algorithm: 目标算法名称
+        :param chunk_size: 每次读取的行数, 也是每个进程池任务的行数
+        :param batch_size: 每个事务写回的行数
+        :param max_workers: 进程数, 默认为CPU个数, 0表示在当前进程中计算
+        :param checkpoint_path: 检查点文件路径, None表示不记录进度
+        :param log_interval: 输出进度日志的间隔 (秒)
+        :param paramstyle: SQL参数占位符风格 'qmark' (?) 或 'format' (%s), 默认根据连接类型推断
+        """
+        for identifier in (table, id_column, password_column):
+            if not _IDENTIFIER_REGEX.match(identifier):
+                raise ValueError("Invalid identifier: '%s'." % identifier)
+        if mode not in ('rewrap', 'rehash'):
+            raise ValueError("mode must be 'rewrap' or 'rehash'.")
+
+        source_algorithms = list(source_algorithms)
+        for alg in source_algorithms:
+            if mode == 'rewrap':
+                name = '%s_%s' % (target_algorithm, alg)
+                if name not in pwd_encoder._INNER_ENCODERS:
+                    if not pwd_encoder._can_wrap(target_algorithm, alg):
+                        raise ValueError("Cannot rewrap '%s' with '%s': digest is longer than %d bytes." %
+                                         (alg, target_algorithm, pwd_encoder._WRAPPING_OUTER_MAX_BYTES[target_algorithm]))
+                    raise ValueError("Cannot rewrap '%s' with '%s'." % (alg, target_algorithm))
+            elif alg not in _REVERSIBLE_ALGORITHMS:
+                raise ValueError("Cannot rehash irreversible algorithm '%s'." % alg)
+        if target_algorithm not in pwd_encoder._INNER_ENCODERS:
+            raise ValueError("alg_id: '%s' not supported." % target_algorithm)
+
+        self.connection = connection
+        self.table = table
+        self.id_column = id_column
+        self.password_column = password_column
+        self.mode = mode
+        self.source_algorithms = source_algorithms
+        self.target_algorithm = target_algorithm
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.max_workers = os.cpu_count() if max_workers is None else max_workers
+        self.checkpoint_path = checkpoint_path
+        self.log_interval = log_interval
+
+        if paramstyle is None:
+            paramstyle = 'qmark' if type(connection).__module__.startswith('sqlite3') else 'format'
+        self._placeholder = '?' if paramstyle == 'qmark' else '%s'
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def run(self):
+        """
+        执行迁移
+
+        :return: 字典 {'migrated': 更新的行数, 'skipped': 跳过的行数, 'last_id': 最后处理的主键, 'elapsed': 耗时 (秒)}
+        """
+        checkpoint = self._load_checkpoint()
+        last_id = checkpoint.get('last_id')
+        migrated = checkpoint.get('migrated', 0)
+        skipped = checkpoint.get('skipped', 0)
+
+        total = self._count_remaining(last_id)
+        processed = 0
+        started = time.monotonic()
+        next_log = started + self.log_interval
+        logging.info('Migrating %d password(s) in %s.', total, self.table)
+
+        executor = self._create_executor()
+        pending = deque()
+        read_id = last_id
+        exhausted = False
+        try:
+            while True:
+                # 读取与计算重叠进行, 最多有2倍进程数的任务在等待
+                while not exhausted and len(pending) < max(1, self.max_workers) * 2:
+                    rows = self._fetch_chunk(read_id)
+                    if not rows:
+                        exhausted = True
+                        break
+                    read_id = rows[-1][0]
+                    pending.append((rows[-1][0], len(rows), self._submit(executor, rows)))
+
+                if not pending:
+                    break
+
+                chunk_last_id, chunk_size, future = pending.popleft()
+                updates = future.result()
+                updated = self._write(updates)
+                migrated += updated
+                skipped += chunk_size - updated
+                processed += chunk_size
+                last_id = chunk_last_id
+                self._save_checkpoint({'last_id': last_id, 'migrated': migrated, 'skipped': skipped})
+
+                now = time.monotonic()
+                if now >= next_log:
+                    self._log_progress(processed, total, now - started)
+                    next_log = now + self.log_interval
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+        elapsed = time.monotonic() - started
+        self._log_progress(processed, total, elapsed)
+        return {'migrated': migrated, 'skipped': skipped, 'last_id': last_id, 'elapsed': elapsed}
+
+    def _create_executor(self):
+        if self.max_workers <= 0:
+            return None
+        return futures.ProcessPoolExecutor(max_workers=self.max_workers,
+                                           initializer=_init_worker,
+                                           initargs=(_get_work_factors(),))
+
+    def _submit(self, executor, rows):
+        args = (rows, self.mode, self.target_algorithm)
+        if executor is None:
+            future = futures.Future()
+            future.set_result(_convert_rows(*args))
+            return future
+        return executor.submit(_convert_rows, *args)
+
+    def _where(self):
+        # 不使用LIKE: 算法名称中的'_'是通配符, 例如bcrypt_md5会匹配bcryptXmd5
+        prefixes = ['{%s}' % x for x in self.source_algorithms]
+        conditions = ' OR '.join('SUBSTR(%s, 1, %d) = %s' % (self.password_column, len(x), self._placeholder)
+                                 for x in prefixes)
+        return '(%s)' % conditions, prefixes
+
+    def _count_remaining(self, last_id):
+        where, params = self._where()
+        sql = 'SELECT COUNT(*) FROM %s WHERE %s' % (self.table, where)
+        if last_id is not None:
+            sql += ' AND %s > %s' % (self.id_column, self._placeholder)
+            params.append(last_id)
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            return cursor.fetchone()[0]
+        finally:
+            cursor.close()
+
+    def _fetch_chunk(self, last_id):
+        where, params = self._where()
+        sql = 'SELECT %s, %s FROM %s WHERE %s' % (self.id_column, self.password_column, self.table, where)
+        if last_id is not None:
+            sql += ' AND %s > %s' % (self.id_column, self._placeholder)
+            params.append(last_id)
+        sql += ' ORDER BY %s LIMIT %d' % (self.id_column, self.chunk_size)
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            return [tuple(x) for x in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def _write(self, updates):
+        """
+        :param updates: 列表 [(新密文, 主键, 旧密文), ...]
+        :return: 实际更新的行数
+        """
+        sql = 'UPDATE %s SET %s = %s WHERE %s = %s AND %s = %s' % (
+            self.table,
+            self.password_column, self._placeholder,
+            self.id_column, self._placeholder,
+            self.password_column, self._placeholder,
+        )
+        ret = 0
+        for i in range(0, len(updates), self.batch_size):
+            batch = updates[i:i + self.batch_size]
+            cursor = self.connection.cursor()
+            try:
+                cursor.executemany(sql, batch)
+                # 部分驱动的executemany不返回rowcount
+                ret += cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else len(batch)
+                self.connection.commit()
+            except BaseException:
+                self.connection.rollback()
+                raise
+            finally:
+                cursor.close()
+        return ret
+
+    def _log_progress(self, processed, total, elapsed):
+        rate = processed / elapsed if elapsed > 0 else 0
+        remaining = max(0, total - processed)
+        eta = remaining / rate if rate > 0 else float('inf')
+        logging.info('Migrated %d/%d password(s) in %s, %.1f rows/s, ETA %.0fs.',
+                     processed, total, self.table, rate, eta)
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('task') != self._task():
+            raise ValueError("Checkpoint '%s' belongs to another migration: %s." % (self.checkpoint_path,
+                                                                                  checkpoint.get('task')))
+        return checkpoint
+
+    def _task(self):
+        # 用于确认检查点文件属于同一个迁移任务
+        return {
+            'table': self.table,
+            'mode': self.mode,
+            'source_algorithms': self.source_algorithms,
+            'target_algorithm': self.target_algorithm,
+        }
+
+    def _save_checkpoint(self, checkpoint):
+        if not self.checkpoint_path:
+            return
+        checkpoint = dict(checkpoint, task=self._task())
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def _get_work_factors():
+    ret = {
+        'scrypt_n': pwd_encoder.ScryptPasswordEncoder.n,
+        'scrypt_r': pwd_encoder.ScryptPasswordEncoder.r,
+        'scrypt_p': pwd_encoder.ScryptPasswordEncoder.p,
+        'pbkdf2_iterations': pwd_encoder.Pbkdf2PasswordEncoder.iterations,
+    }
+    if pwd_encoder._BCRYPT_PRESENT:
+        ret['bcrypt_rounds'] = pwd_encoder.BcryptPasswordEncoder.rounds
+    return ret
+
+
+def _init_worker(work_factors):
+    # 子进程使用与父进程相同的计算强度 (父进程可能调用过calibrate_work_factors)
+    pwd_encoder.ScryptPasswordEncoder.n = work_factors['scrypt_n']
+    pwd_encoder.ScryptPasswordEncoder.r = work_factors['scrypt_r']
+    pwd_encoder.ScryptPasswordEncoder.p = work_factors['scrypt_p']
+    pwd_encoder.Pbkdf2PasswordEncoder.iterations = work_factors['pbkdf2_iterations']
+    if 'bcrypt_rounds' in work_factors:
+        pwd_encoder.BcryptPasswordEncoder.rounds = work_factors['bcrypt_rounds']
+
+
+def _convert_rows(rows, mode, target_algorithm):
+    # 在子进程中执行, 返回 [(新密文, 主键, 旧密文), ...], 无法转换的行被忽略
+    # noinspection PyProtectedMember
+    split = pwd_encoder.DelegatingPasswordEncoder._get_alg_and_real_encoded_password
+    encoders = pwd_encoder._INNER_ENCODERS
+    ret = []
+    for pk, encoded_password in rows:
+        alg, real_encoded_password = split(encoded_password)
+        if mode == 'rewrap':
+            alg_id = '%s_%s' % (target_algorithm, alg)
+            encoder = encoders.get(alg_id)
+            if encoder is None:
+                continue
+            new_password = '{%s}%s' % (alg_id, encoder.wrap(real_encoded_password))
+        else:
+            reverse = _REVERSIBLE_ALGORITHMS.get(alg)
+            if reverse is None:
+                continue
+            raw_password = reverse(real_encoded_password)
+            new_password = '{%s}%s' % (target_algorithm, encoders[target_algorithm].encode_password(raw_password))
+        ret.append((new_password, pk, encoded_password))
+    return ret
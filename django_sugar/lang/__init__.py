@@ -9,7 +9,10 @@ r"""
     https://github.com/yingzhuo/django-sugar
 
 """
+from .ahocorasick import *
 from .base64 import *
+from .bloom import *
+from .cache import *
 from .codec import *
 from .common import *
 from .enum_mixin import *
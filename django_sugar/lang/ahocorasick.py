@@ -0,0 +1,159 @@
+r"""
+ ____  _                           ____
+|  _ \(_) __ _ _ __   __ _  ___   / ___| _   _  __ _  __ _ _ __
+| | | | |/ _` | '_ \ / _` |/ _ \  \___ \| | | |/ _` |/ _` | '__|
+| |_| | | (_| | | | | (_| | (_) |  ___) | |_| | (_| | (_| | |
+|____// |\__,_|_| |_|\__, |\___/  |____/ \__,_|\__, |\__,_|_|
+    |__/             |___/                     |___/
+
+    https://github.com/yingzhuo/django-sugar
+
+"""
+import collections
+import threading
+
+
+class AhoCorasick(object):
+    """
+    Aho-Corasick多模式匹配自动机
+
+    一次扫描文本即可找出所有模式串的出现位置, 耗时与文本长度成正比, 与模式串的个数无关。
+    构建时把失败指针展开成完整的状态转移表 (只包含模式串中出现过的字符), 匹配时每个字符只查一次字典。
+
+    构建完成后本类是只读的, 可以被多个线程同时使用。
+    """
+
+    def __init__(self, patterns=None, *, ignore_case=True):
+        """
+        构造方法
+
+        :param patterns: 模式串 -> 值 的字典, 或者模式串的可迭代对象 (值为模式串本身)
+        :param ignore_case: 是否忽略大小写
+        """
+        self.ignore_case = ignore_case
+        self._patterns = []
+        self._lock = threading.Lock()
+        self._delta = None
+        self._outputs = None
+
+        if isinstance(patterns, dict):
+            for pattern, value in patterns.items():
+                self.add(pattern, value)
+        elif patterns is not None:
+            for pattern in patterns:
+                self.add(pattern)
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def add(self, pattern, value=None):
+        """
+        添加模式串
+
+        添加后需要重新构建, 下一次匹配时自动进行。
+
+        :param pattern: 模式串
+        :param value: 匹配时返回的值, 默认为模式串本身
+        """
+        if not pattern:
+            raise ValueError('pattern must not be empty.')
+        with self._lock:
+            self._patterns.append((pattern, pattern if value is None else value))
+            self._delta = None
+
+    def build(self):
+        """
+        构建自动机
+        """
+        with self._lock:
+            if self._delta is None:
+                self._outputs, self._delta = self._build()
+
+    def _build(self):
+        goto = [{}]
+        outputs = [[]]
+        for pattern, value in self._patterns:
+            if self.ignore_case:
+                pattern = pattern.lower()
+            node = 0
+            for ch in pattern:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto.append({})
+                    outputs.append([])
+                    goto[node][ch] = nxt
+                node = nxt
+            outputs[node].append(value)
+
+        # 按广度优先的顺序计算失败指针, 同时展开为完整的转移表
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = collections.deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            transitions = dict(delta[fail[node]])
+            for ch, nxt in goto[node].items():
+                fail[nxt] = delta[fail[node]].get(ch, 0)
+                outputs[nxt].extend(outputs[fail[nxt]])
+                transitions[ch] = nxt
+                queue.append(nxt)
+            delta[node] = transitions
+
+        return [tuple(x) for x in outputs], delta
+
+    def _get_tables(self):
+        if self._delta is None:
+            self.build()
+        return self._delta, self._outputs
+
+    def iter_matches(self, text):
+        """
+        查找所有匹配
+
+        :param text: 文本
+        :return: 生成器, 元素为 (模式串在文本中结束的位置 (不包含), 值)
+        """
+        delta, outputs = self._get_tables()
+        if self.ignore_case:
+            text = text.lower()
+        node = 0
+        for i, ch in enumerate(text):
+            node = delta[node].get(ch, 0)
+            for value in outputs[node]:
+                yield i + 1, value
+
+    def find_values(self, text):
+        """
+        查找文本中出现的所有模式串对应的值
+
+        :param text: 文本
+        :return: 值的集合
+        """
+        delta, outputs = self._get_tables()
+        if self.ignore_case:
+            text = text.lower()
+        ret = set()
+        node = 0
+        for ch in text:
+            node = delta[node].get(ch, 0)
+            if outputs[node]:
+                ret.update(outputs[node])
+        return ret
+
+    def contains_any(self, text):
+        """
+        判断文本中是否出现了任意一个模式串
+
+        :param text: 文本
+        :return: 结果
+        """
+        delta, outputs = self._get_tables()
+        if self.ignore_case:
+            text = text.lower()
+        node = 0
+        for ch in text:
+            node = delta[node].get(ch, 0)
+            if outputs[node]:
+                return True
+        return False
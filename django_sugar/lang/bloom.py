@@ -0,0 +1,87 @@
+r"""
+ ____  _                           ____
+|  _ \(_) __ _ _ __   __ _  ___   / ___| _   _  __ _  __ _ _ __
+| | | | |/ _` | '_ \ / _` |/ _ \  \___ \| | | |/ _` |/ _` | '__|
+| |_| | | (_| | | | | (_| | (_) |  ___) | |_| | (_| | (_| | |
+|____// |\__,_|_| |_|\__, |\___/  |____/ \__,_|\__, |\__,_|_|
+    |__/             |___/                     |___/
+
+    https://github.com/yingzhuo/django-sugar
+
+"""
+import hashlib
+import math
+
+from django_sugar.lang import strtool
+
+
+class BloomFilter(object):
+    """
+    布隆过滤器
+
+    判断结果为False时元素一定不在集合中, 为True时元素可能在集合中。
+    本类不是线程安全的, 多个线程同时添加元素时需要由调用方加锁。
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.001):
+        """
+        构造方法
+
+        :param capacity: 预计元素个数
+        :param error_rate: 元素个数不超过capacity时的误判率
+        """
+        if capacity < 1:
+            raise ValueError('capacity must be positive.')
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate must be between 0 and 1.')
+
+        num_bits = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._num_bits = num_bits
+        self._num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        self._bits = bytearray((num_bits + 7) // 8)
+        self._count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(strtool.ensure_bytes(item), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        num_bits = self._num_bits
+        return [(h1 + i * h2) % num_bits for i in range(self._num_hashes)]
+
+    def add(self, item):
+        """
+        添加元素
+
+        :param item: 元素 (字符串或字节数组)
+        """
+        bits = self._bits
+        for pos in self._positions(item):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self._count += 1
+
+    def __contains__(self, item):
+        # 逐个计算位置, 不在集合中的元素通常在前一两个位置就能确定
+        digest = hashlib.blake2b(strtool.ensure_bytes(item), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        num_bits = self._num_bits
+        bits = self._bits
+        for _ in range(self._num_hashes):
+            pos = h1 % num_bits
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+            h1 += h2
+        return True
+
+    def __len__(self):
+        # 添加的次数, 重复添加的元素会被重复计数
+        return self._count
+
+    def clear(self):
+        """
+        清空过滤器
+        """
+        self._bits = bytearray(len(self._bits))
+        self._count = 0
@@ -0,0 +1,119 @@
+r"""
+ ____  _                           ____
+|  _ \(_) __ _ _ __   __ _  ___   / ___| _   _  __ _  __ _ _ __
+| | | | |/ _` | '_ \ / _` |/ _ \  \___ \| | | |/ _` |/ _` | '__|
+| |_| | | (_| | | | | (_| | (_) |  ___) | |_| | (_| | (_| | |
+|____// |\__,_|_| |_|\__, |\___/  |____/ \__,_|\__, |\__,_|_|
+    |__/             |___/                     |___/
+
+    https://github.com/yingzhuo/django-sugar
+
+"""
+import collections
+import threading
+import time
+
+
+class LRUCache(object):
+    """
+    有界LRU缓存 (线程安全)
+
+    每个条目可以有自己的过期时间点, 过期的条目在被访问时删除。
+    容量满时淘汰最久未被访问的条目。
+    """
+
+    def __init__(self, max_size=1024, *, ttl=None, clock=time.monotonic):
+        """
+        构造方法
+
+        :param max_size: 最大条目数
+        :param ttl: 默认存活时间 (秒), None表示不过期
+        :param clock: 时钟函数
+        """
+        if max_size < 1:
+            raise ValueError('max_size must be positive.')
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        """
+        获取缓存的值
+
+        :param key: 键
+        :param default: 不存在或已过期时返回的值
+        :return: 结果
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > self._clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, *, ttl=None, expires_at=None):
+        """
+        设置缓存的值
+
+        :param key: 键
+        :param value: 值
+        :param ttl: 存活时间 (秒), 默认使用构造时指定的值
+        :param expires_at: 过期时间点 (与clock同一时间基准), 与ttl同时指定时取较早者
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if ttl is not None:
+            deadline = self._clock() + ttl
+            expires_at = deadline if expires_at is None else min(expires_at, deadline)
+
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """
+        删除缓存的值
+
+        :param key: 键
+        :return: 键存在时返回True
+        """
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        """
+        清空缓存
+        """
+        with self._lock:
+            self._data.clear()
+
+    @property
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+_MISSING = object()
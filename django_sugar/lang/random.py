@@ -9,21 +9,107 @@ r"""
     https://github.com/yingzhuo/django-sugar
 
 """
+import functools
+import os
 import random as r
+import secrets
 import string as s
+import threading
+
+# 每次从os.urandom读取的字节数
+_ENTROPY_BLOCK_SIZE = 4096
+
+_entropy_local = threading.local()
+
+
+def _reset_entropy_buffer():
+    # fork后子进程不能复用父进程缓冲区中的随机字节
+    global _entropy_local
+    _entropy_local = threading.local()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_entropy_buffer)
+
+
+def _read_entropy(size):
+    if size > _ENTROPY_BLOCK_SIZE:
+        return os.urandom(size)
+
+    local = _entropy_local
+    buffer = getattr(local, 'buffer', None)
+    position = getattr(local, 'position', 0)
+    if buffer is None or position + size > len(buffer):
+        buffer = local.buffer = os.urandom(_ENTROPY_BLOCK_SIZE)
+        position = 0
+    local.position = position + size
+    return buffer[position:position + size]
+
+
+@functools.lru_cache(maxsize=64)
+def _get_translation(chars):
+    # 只支持单字节(Latin-1)字符集, 其他情况返回None
+    size = len(chars)
+    if size == 0 or size > 256 or any(ord(c) > 255 for c in chars):
+        return None
+
+    # 拒绝采样: 丢弃大于等于limit的字节, 保证每个字符的概率相同
+    limit = 256 - 256 % size
+    encoded = chars.encode('latin-1')
+    table = bytes(encoded[b % size] for b in range(256))
+    return table, bytes(range(limit, 256)), limit / 256
+
+
+def _translate_random_bytes(length, translation):
+    table, delete, accept_ratio = translation
+    parts = []
+    remaining = length
+    while remaining > 0:
+        accepted = _read_entropy(int(remaining / accept_ratio) + 8).translate(table, delete)
+        parts.append(accepted[:remaining])
+        remaining -= len(accepted)
+    return b''.join(parts).decode('latin-1')
 
 
 def random_string(length, *, chars):
     """
     生成随机字符串
 
+    使用操作系统提供的密码学安全随机数, 可以用于生成令牌。
+
     :param length: 要生成的字符串长度
     :param chars: 可选的字符集合 (string)
     :return: 随机字符串
     """
     if length < 1:
         return ''
-    return ''.join(r.choice(chars) for _ in range(length))
+
+    translation = _get_translation(chars) if isinstance(chars, str) else None
+    if translation is None:
+        return ''.join(secrets.choice(chars) for _ in range(length))
+    return _translate_random_bytes(length, translation)
+
+
+def random_strings(n, length, chars):
+    """
+    批量生成随机字符串
+
+    :param n: 要生成的字符串个数
+    :param length: 每个字符串的长度
+    :param chars: 可选的字符集合 (string)
+    :return: 随机字符串列表
+    """
+    if n < 1:
+        return []
+    if length < 1:
+        return [''] * n
+
+    translation = _get_translation(chars) if isinstance(chars, str) else None
+    if translation is None:
+        return [random_string(length, chars=chars) for _ in range(n)]
+
+    data = _translate_random_bytes(n * length, translation)
+    return [data[i:i + length] for i in range(0, n * length, length)]
 
 
 def random_ascii_letters(length):
@@ -11,4 +11,4 @@ r"""
 """
 from .datedesc import calculate_age, DateDesc, DateDescField, DatePair, DatePairField
 from .intpair import IntPair, IntPairField, IntPairList, IntPairListField
-from .password import PasswordField
+from .password import BreachedPasswordIndex, PasswordField, PasswordPolicy
@@ -9,19 +9,287 @@ r"""
     https://github.com/yingzhuo/django-sugar
 
 """
+import hashlib
+import math
+import mmap
+import os
 import string
 
 from rest_framework import fields
 
+_DEFAULT_SPECIAL_CHARACTERS = r'!@#$%^&*()_+-,./<>/?;:|'
+
+# 字符类别的标记, translate之后的字符串中只包含这些字符与非ASCII字符
+_LOWER, _UPPER, _DIGIT, _SPECIAL, _OTHER = '\x01', '\x02', '\x03', '\x04', '\x05'
+_MARKERS = frozenset((_LOWER, _UPPER, _DIGIT, _SPECIAL, _OTHER))
+
+
+class PasswordPolicy(object):
+    """
+    密码策略
+
+    构造时生成字符类别的转换表, 检查时只需一次str.translate即可得到密码中出现的所有字符类别。
+
+    check方法返回违反的规则列表:
+        too_short       长度小于min_length
+        too_long        长度大于max_length
+        no_lower        没有小写字母
+        no_upper        没有大写字母
+        no_digit        没有数字
+        no_special      没有特殊字符
+        too_few_classes 字符类别少于min_classes
+        low_entropy     估算的熵小于min_entropy_bits
+        breached        出现在已泄露密码索引中
+    """
+
+    def __init__(self, *,
+                 min_length=0,
+                 max_length=None,
+                 require_lower=True,
+                 require_upper=True,
+                 require_digit=False,
+                 require_special=True,
+                 special_characters=_DEFAULT_SPECIAL_CHARACTERS,
+                 min_classes=0,
+                 min_entropy_bits=0,
+                 breached_password_index=None):
+        """
+        构造方法
+
+        :param min_length: 最小长度
+        :param max_length: 最大长度, None表示不限制
+        :param require_lower: 是否必须包含小写字母
+        :param require_upper: 是否必须包含大写字母
+        :param require_digit: 是否必须包含数字
+        :param require_special: 是否必须包含特殊字符
+        :param special_characters: 特殊字符集合
+        :param min_classes: 至少包含的字符类别数 (小写/大写/数字/特殊字符/其他)
+        :param min_entropy_bits: 最小的熵 (比特), 按 长度 * log2(字符池大小) 估算
+        :param breached_password_index: BreachedPasswordIndex实例, 默认不检查
+        """
+        self.min_length = min_length
+        self.max_length = max_length
+        self.require_lower = require_lower
+        self.require_upper = require_upper
+        self.require_digit = require_digit
+        self.require_special = require_special
+        self.special_characters = special_characters
+        self.min_classes = min_classes
+        self.min_entropy_bits = min_entropy_bits
+        self.breached_password_index = breached_password_index
+
+        # 所有ASCII字符都在表中, 表外的字符 (非ASCII) 原样保留, 视为其他字符
+        table = {x: _OTHER for x in range(128)}
+        table.update({ord(x): _LOWER for x in string.ascii_lowercase})
+        table.update({ord(x): _UPPER for x in string.ascii_uppercase})
+        table.update({ord(x): _DIGIT for x in string.digits})
+        table.update({ord(x): _SPECIAL for x in special_characters})
+        self._table = table
+
+        # 估算熵时各类别的字符池大小
+        self._pool_sizes = {
+            _LOWER: len(string.ascii_lowercase),
+            _UPPER: len(string.ascii_uppercase),
+            _DIGIT: len(string.digits),
+            _SPECIAL: len(set(special_characters)),
+            _OTHER: 32,
+        }
+
+    def get_character_classes(self, password):
+        """
+        获取密码中出现的字符类别
+
+        :param password: 密码
+        :return: 集合, 元素为 'lower', 'upper', 'digit', 'special', 'other'
+        """
+        present = self._classify(password)
+        return {name for marker, name in _CLASS_NAMES.items() if marker in present}
+
+    def _classify(self, password):
+        present = set(password.translate(self._table))
+        if not present <= _MARKERS:
+            present = (present & _MARKERS) | {_OTHER}
+        return present
+
+    def estimate_entropy(self, password, present=None):
+        """
+        估算密码的熵
+
+        :param password: 密码
+        :param present: 内部使用
+        :return: 熵 (比特)
+        """
+        if present is None:
+            present = self._classify(password)
+        pool_size = sum(self._pool_sizes[x] for x in present)
+        return len(password) * math.log2(pool_size) if pool_size > 1 else 0.0
+
+    def check(self, password):
+        """
+        检查密码
+
+        :param password: 密码
+        :return: 违反的规则列表, 空列表表示密码符合策略
+        """
+        ret = []
+        length = len(password)
+        if length < self.min_length:
+            ret.append('too_short')
+        if self.max_length is not None and length > self.max_length:
+            ret.append('too_long')
+
+        present = self._classify(password)
+        if self.require_lower and _LOWER not in present:
+            ret.append('no_lower')
+        if self.require_upper and _UPPER not in present:
+            ret.append('no_upper')
+        if self.require_digit and _DIGIT not in present:
+            ret.append('no_digit')
+        if self.require_special and _SPECIAL not in present:
+            ret.append('no_special')
+        if len(present) < self.min_classes:
+            ret.append('too_few_classes')
+        if self.min_entropy_bits and self.estimate_entropy(password, present) < self.min_entropy_bits:
+            ret.append('low_entropy')
+
+        # 放在最后, 前面的规则不满足时不必查询索引
+        if not ret and self.breached_password_index is not None and password in self.breached_password_index:
+            ret.append('breached')
+        return ret
+
+    def is_valid(self, password):
+        """
+        判断密码是否符合策略
+
+        :param password: 密码
+        :return: 结果
+        """
+        return not self.check(password)
+
+
+_CLASS_NAMES = {
+    _LOWER: 'lower',
+    _UPPER: 'upper',
+    _DIGIT: 'digit',
+    _SPECIAL: 'special',
+    _OTHER: 'other',
+}
+
+
+class BreachedPasswordIndex(object):
+    """
+    已泄露密码索引
+
+    索引文件由定长记录组成, 每条记录为密码SHA-1摘要的前record_size个字节, 按字节序升序排列。
+    文件通过mmap映射到内存, 查询时二分查找, 只读取用到的页面, 不会将整个文件读入内存。
+
+    可以使用build_from_hibp从Have I Been Pwned的SHA-1文本文件 ('SHA1:次数' 每行一条, 已排序) 生成索引文件。
+    """
+
+    def __init__(self, path, *, record_size=20):
+        """
+        构造方法
+
+        :param path: 索引文件路径
+        :param record_size: 每条记录的字节数 (1 ~ 20), 小于20时有一定的误判率, 但文件更小
+        """
+        if not 1 <= record_size <= 20:
+            raise ValueError('record_size must be between 1 and 20.')
+
+        self.record_size = record_size
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size % record_size:
+            self._file.close()
+            raise ValueError("Size of '%s' is not a multiple of %d." % (path, record_size))
+
+        self._count = size // record_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, password):
+        return self.contains_sha1(hashlib.sha1(password.encode('utf-8')).digest())
+
+    def contains_sha1(self, digest):
+        """
+        判断SHA-1摘要是否在索引中
+
+        :param digest: SHA-1摘要 (bytes或十六进制字符串)
+        :return: 结果
+        """
+        if isinstance(digest, str):
+            digest = bytes.fromhex(digest)
+        key = digest[:self.record_size]
+        size = self.record_size
+        data = self._mmap
+
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) // 2
+            record = data[mid * size:(mid + 1) * size]
+            if record < key:
+                low = mid + 1
+            elif record > key:
+                high = mid
+            else:
+                return True
+        return False
+
+    def close(self):
+        if self._count:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def build_from_hibp(source_path, target_path, *, record_size=20):
+        """
+        从HIBP的SHA-1文本文件生成索引文件, 逐行处理, 不会将文件读入内存
+
+        :param source_path: 文本文件路径, 每行为 'SHA1十六进制:次数', 必须已按摘要排序
+        :param target_path: 索引文件路径
+        :param record_size: 每条记录的字节数
+        :return: 记录数
+        """
+        count = 0
+        last = b''
+        with open(source_path, 'r', encoding='ascii') as source, open(target_path, 'wb') as target:
+            for line in source:
+                line = line.strip()
+                if not line:
+                    continue
+                record = bytes.fromhex(line.split(':', 1)[0])[:record_size]
+                if record < last:
+                    raise ValueError("'%s' is not sorted." % source_path)
+                if record == last:
+                    # 截断后重复的记录只保留一条
+                    continue
+                target.write(record)
+                last = record
+                count += 1
+        return count
+
 
 class PasswordField(fields.CharField):
     """
     密码(口令)相关Field
 
     用于序列化器
+    可以通过password_policy参数指定PasswordPolicy, 否则根据must_contains_*参数生成。
     """
     default_error_messages = {
         'invalid': "Invalid password.",
+        'too_short': "Password is too short.",
+        'too_long': "Password is too long.",
+        'low_entropy': "Password is too weak.",
+        'breached': "Password has appeared in a data breach.",
     }
 
     must_contains_lower_case_letter = True
@@ -34,11 +302,18 @@ class PasswordField(fields.CharField):
                  must_contains_upper_case_letter=True,
                  must_contains_special_character_letter=True,
                  special_character_set=None,
+                 password_policy=None,
                  **kwargs):
         self.must_contains_lower_case_letter = must_contains_lower_case_letter
         self.must_contains_upper_case_letter = must_contains_upper_case_letter
         self.must_contains_special_character_letter = must_contains_special_character_letter
-        self.special_character_set = special_character_set or r'!@#$%^&*()_+-,./<>/?;:|'
+        self.special_character_set = special_character_set or _DEFAULT_SPECIAL_CHARACTERS
+        self.password_policy = password_policy or PasswordPolicy(
+            require_lower=must_contains_lower_case_letter,
+            require_upper=must_contains_upper_case_letter,
+            require_special=must_contains_special_character_letter,
+            special_characters=self.special_character_set,
+        )
         super().__init__(**kwargs)
 
     def to_representation(self, value):
@@ -47,37 +322,10 @@ class PasswordField(fields.CharField):
     def to_internal_value(self, data):
         ret = super().to_internal_value(data)
 
-        # 检查特殊字符包含情况
-        ng1 = True
-        if self.must_contains_special_character_letter:
-            for ch in ret:
-                if ch in self.special_character_set:
-                    ng1 = False
-                    break
-        else:
-            ng1 = False
-
-        # 检查小写字符包含情况
-        ng2 = True
-        if self.must_contains_lower_case_letter:
-            for ch in ret:
-                if ch in string.ascii_lowercase:
-                    ng2 = False
-                    break
-        else:
-            ng2 = False
-
-        # 检查大写字符包含情况
-        ng3 = True
-        if self.must_contains_upper_case_letter:
-            for ch in ret:
-                if ch in string.ascii_uppercase:
-                    ng3 = False
-                    break
-        else:
-            ng3 = False
-
-        if ng1 or ng2 or ng3:
-            self.fail('invalid')
+        violations = self.password_policy.check(ret)
+        if violations:
+            # 字符类别相关的规则使用原有的'invalid'错误
+            code = violations[0]
+            self.fail(code if code in self.error_messages else 'invalid')
 
         return ret
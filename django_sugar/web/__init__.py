@@ -12,12 +12,19 @@ r"""
 from jwt import unregister_algorithm, register_algorithm, algorithms
 
 from .auth import *
+from .auth_metrics import *
+from .binder import *
 from .file_storage import *
 from .http import *
 from .jwt_base import *
+from .jwt_keyring import *
 from .pwd_encoder import *
+from .representation import *
 from .token import *
 from .token_jwt import *
+from .token_revocation import *
+from .token_store import *
+from .useragent import *
 
 
 # ----------------------------------------------------------------------------------------------------------------------
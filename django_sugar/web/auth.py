@@ -10,7 +10,9 @@ r"""
 
 """
 import abc
+import time
 
+from asgiref.sync import sync_to_async
 from rest_framework import authentication
 
 from django_sugar import lang
@@ -31,6 +33,14 @@ class Authenticator(authentication.BaseAuthentication, metaclass=abc.ABCMeta):
         :return: 认证成功时返回二元组(User, Token) 否则返回None
         """
 
+    async def aauthenticate(self, request):
+        """
+        认证一个请求 (异步)
+        :param request: 请求实例
+        :return: 认证成功时返回二元组(User, Token) 否则返回None
+        """
+        return await sync_to_async(self.authenticate)(request)
+
     def authenticate_header(self, request):
         return '403 Permission Denied' if request.user else '401 Unauthenticated'
 
@@ -46,7 +56,12 @@ class TokenBasedAuthenticator(Authenticator):
     # 从令牌中找到用户实体时发生异常是否抛出
     raise_if_user_finding_error = True
 
+    # 认证流程指标接收器 (AuthMetricsSink实例) 默认不采集
+    auth_metrics_sink = None
+
     def authenticate(self, request):
+        sink = self.auth_metrics_sink
+        started = time.perf_counter_ns() if sink is not None else 0
 
         resolve_token = lang.get_callable_attr(self,
                                                'resolve_token',
@@ -56,12 +71,18 @@ class TokenBasedAuthenticator(Authenticator):
         # noinspection PyBroadException
         try:
             token = resolve_token(request)
-        except Exception:
+        except Exception as exc:
+            if sink is not None:
+                sink.record_failure('resolve_token', exc)
             if self.raise_if_token_resolving_error:
                 raise
             else:
                 token = None
 
+        if sink is not None:
+            resolved = time.perf_counter_ns()
+            sink.record_timing('resolve_token', resolved - started)
+
         if not token:
             return None
 
@@ -73,12 +94,82 @@ class TokenBasedAuthenticator(Authenticator):
         # noinspection PyBroadException
         try:
             user = get_user_by_token(token)
-        except Exception:
+        except Exception as exc:
+            if sink is not None:
+                sink.record_failure('get_user_by_token', exc)
             if self.raise_if_user_finding_error:
                 raise
             else:
                 user = None
 
+        if sink is not None:
+            # noinspection PyUnboundLocalVariable
+            finished = time.perf_counter_ns()
+            sink.record_timing('get_user_by_token', finished - resolved)
+            sink.record_timing('authenticate', finished - started)
+
+        if user:
+            return user, token
+        else:
+            return None
+
+    async def aauthenticate(self, request):
+        sink = self.auth_metrics_sink
+        started = time.perf_counter_ns() if sink is not None else 0
+
+        aresolve_token = lang.get_callable_attr(self, 'aresolve_token', raise_error=False)
+        resolve_token = lang.get_callable_attr(self,
+                                               'resolve_token',
+                                               raise_error=aresolve_token is None,
+                                               error_msg='Forgot TokenResolver mixin?')
+
+        # noinspection PyBroadException
+        try:
+            if aresolve_token:
+                token = await aresolve_token(request)
+            else:
+                token = resolve_token(request)
+        except Exception as exc:
+            if sink is not None:
+                sink.record_failure('resolve_token', exc)
+            if self.raise_if_token_resolving_error:
+                raise
+            else:
+                token = None
+
+        if sink is not None:
+            resolved = time.perf_counter_ns()
+            sink.record_timing('resolve_token', resolved - started)
+
+        if not token:
+            return None
+
+        aget_user_by_token = lang.get_callable_attr(self, 'aget_user_by_token', raise_error=False)
+        get_user_by_token = lang.get_callable_attr(self,
+                                                   'get_user_by_token',
+                                                   raise_error=aget_user_by_token is None,
+                                                   error_msg='Forgot TokenBasedUserFinder mixin?')
+
+        # noinspection PyBroadException
+        try:
+            if aget_user_by_token:
+                user = await aget_user_by_token(token)
+            else:
+                user = await sync_to_async(get_user_by_token)(token)
+        except Exception as exc:
+            if sink is not None:
+                sink.record_failure('get_user_by_token', exc)
+            if self.raise_if_user_finding_error:
+                raise
+            else:
+                user = None
+
+        if sink is not None:
+            # noinspection PyUnboundLocalVariable
+            finished = time.perf_counter_ns()
+            sink.record_timing('get_user_by_token', finished - resolved)
+            sink.record_timing('authenticate', finished - started)
+
         if user:
             return user, token
         else:
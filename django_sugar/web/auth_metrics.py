@@ -0,0 +1,183 @@
+r"""
+ ____  _                           ____
+|  _ \(_) __ _ _ __   __ _  ___   / ___| _   _  __ _  __ _ _ __
+| | | | |/ _` | '_ \ / _` |/ _ \  \___ \| | | |/ _` |/ _` | '__|
+| |_| | | (_| | | | | (_| | (_) |  ___) | |_| | (_| | (_| | |
+|____// |\__,_|_| |_|\__, |\___/  |____/ \__,_|\__, |\__,_|_|
+    |__/             |___/                     |___/
+
+    https://github.com/yingzhuo/django-sugar
+
+"""
+import abc
+import collections
+import logging
+import socket
+import threading
+
+
+class AuthMetricsSink(object, metaclass=abc.ABCMeta):
+    """
+    认证流程指标的接收器
+
+    本类为抽象类。
+    认证器的auth_metrics_sink属性为None时不采集任何指标。
+
+    阶段(stage)名称:
+        authenticate        整个认证过程
+        resolve_token       从请求中解析令牌
+        get_user_by_token   从令牌中获取用户
+        verify_token        令牌验签 (JWT)
+        convert_user        claims转换为用户 (JWT)
+        hashing_wait        慢哈希任务的排队等待时间 (HashingExecutor)
+    """
+
+    @abc.abstractmethod
+    def record_timing(self, stage, elapsed_ns):
+        """
+        记录耗时
+
+        :param stage: 阶段名称
+        :param elapsed_ns: 耗时 (纳秒)
+        """
+
+    @abc.abstractmethod
+    def record_failure(self, stage, exc):
+        """
+        记录失败
+
+        :param stage: 阶段名称
+        :param exc: 异常实例
+        """
+
+
+class LoggingAuthMetricsSink(AuthMetricsSink):
+    """
+    将指标写入日志
+    """
+
+    def __init__(self, *, logger_name='django_sugar.auth', level=logging.DEBUG):
+        self._logger = logging.getLogger(logger_name)
+        self._level = level
+
+    def record_timing(self, stage, elapsed_ns):
+        if self._logger.isEnabledFor(self._level):
+            self._logger.log(self._level, '%s took %.3f ms', stage, elapsed_ns / 1e6)
+
+    def record_failure(self, stage, exc):
+        if self._logger.isEnabledFor(self._level):
+            self._logger.log(self._level, '%s failed: %s', stage, type(exc).__name__)
+
+
+class HistogramAuthMetricsSink(AuthMetricsSink):
+    """
+    进程内直方图
+
+    耗时按2的幂分桶 (纳秒), 可以近似计算百分位数。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._failures = collections.Counter()
+
+    def record_timing(self, stage, elapsed_ns):
+        bucket = max(0, int(elapsed_ns)).bit_length()
+        with self._lock:
+            stat = self._timings.get(stage)
+            if stat is None:
+                stat = self._timings[stage] = _TimingStat()
+            stat.add(elapsed_ns, bucket)
+
+    def record_failure(self, stage, exc):
+        with self._lock:
+            self._failures[(stage, type(exc).__name__)] += 1
+
+    def percentile(self, stage, q):
+        """
+        近似百分位数
+
+        :param stage: 阶段名称
+        :param q: 百分位 (0 ~ 100)
+        :return: 耗时上界 (纳秒), 没有数据时返回None
+        """
+        with self._lock:
+            stat = self._timings.get(stage)
+            if stat is None or stat.count == 0:
+                return None
+            threshold = stat.count * q / 100
+            seen = 0
+            for bucket in sorted(stat.buckets):
+                seen += stat.buckets[bucket]
+                if seen >= threshold:
+                    return min(1 << bucket, stat.max)
+            return stat.max
+
+    def snapshot(self):
+        """
+        获取当前的统计数据
+
+        :return: 字典
+        """
+        with self._lock:
+            timings = {
+                stage: {
+                    'count': stat.count,
+                    'total_ns': stat.total,
+                    'min_ns': stat.min,
+                    'max_ns': stat.max,
+                    'buckets': {1 << k: v for k, v in sorted(stat.buckets.items())},
+                }
+                for stage, stat in self._timings.items()
+            }
+            failures = {'%s.%s' % k: v for k, v in self._failures.items()}
+        return {'timings': timings, 'failures': failures}
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._failures.clear()
+
+
+class _TimingStat(object):
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.buckets = collections.Counter()
+
+    def add(self, elapsed_ns, bucket):
+        self.count += 1
+        self.total += elapsed_ns
+        self.min = elapsed_ns if self.min is None else min(self.min, elapsed_ns)
+        self.max = max(self.max, elapsed_ns)
+        self.buckets[bucket] += 1
+
+
+class StatsdAuthMetricsSink(AuthMetricsSink):
+    """
+    以StatsD协议通过UDP发送指标
+
+    发送失败时静默忽略, 不影响认证流程。
+    """
+
+    def __init__(self, *, host='127.0.0.1', port=8125, prefix='django_sugar.auth'):
+        self._address = (host, port)
+        self._prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def _send(self, line):
+        try:
+            self._socket.sendto(line.encode('utf-8'), self._address)
+        except OSError:
+            pass
+
+    def record_timing(self, stage, elapsed_ns):
+        self._send('%s.%s:%.3f|ms' % (self._prefix, stage, elapsed_ns / 1e6))
+
+    def record_failure(self, stage, exc):
+        self._send('%s.%s.failure.%s:1|c' % (self._prefix, stage, type(exc).__name__))
@@ -0,0 +1,187 @@
+r"""
+ ____  _                           ____
+|  _ \(_) __ _ _ __   __ _  ___   / ___| _   _  __ _  __ _ _ __
+| | | | |/ _` | '_ \ / _` |/ _ \  \___ \| | | |/ _` |/ _` | '__|
+| |_| | | (_| | | | | (_| | (_) |  ___) | |_| | (_| | (_| | |
+|____// |\__,_|_| |_|\__, |\___/  |____/ \__,_|\__, |\__,_|_|
+    |__/             |___/                     |___/
+
+    https://github.com/yingzhuo/django-sugar
+
+"""
+import threading
+from collections.abc import Mapping
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import Field, SkipField, empty, get_error_detail
+
+# 编译后的绑定器不支持的序列化器方法, 子类重写了其中任意一个时回退到完整的序列化器
+_UNSUPPORTED_OVERRIDES = (
+    '__init__',
+    'is_valid',
+    'run_validation',
+    'validate_empty_values',
+    'to_internal_value',
+    'run_validators',
+    'validate',
+    'set_value',
+)
+
+# 可以安全共享的缺省值类型, 其他的缺省值 (例如列表) 在完整的序列化器中每次都会被深复制
+_IMMUTABLE_DEFAULT_TYPES = (type(None), str, bytes, int, float, bool, tuple, frozenset)
+
+_compile_lock = threading.Lock()
+
+
+def get_compiled_binder(serializer_class):
+    """
+    获取序列化器类型对应的编译后的绑定器
+
+    每个序列化器类型只编译一次, 结果缓存在类型上。
+
+    :param serializer_class: 序列化器类型
+    :return: CompiledBinder实例
+    """
+    binder = serializer_class.__dict__.get('_compiled_binder')
+    if binder is None:
+        with _compile_lock:
+            binder = serializer_class.__dict__.get('_compiled_binder')
+            if binder is None:
+                binder = CompiledBinder(serializer_class)
+                serializer_class._compiled_binder = binder
+    return binder
+
+
+class CompiledBinder(object):
+    """
+    编译后的请求数据绑定器
+
+    DRF每次实例化序列化器都会深复制所有声明的字段并重新绑定, 对于写接口这是绑定数据的主要开销。
+    本类只实例化一次序列化器作为原型, 把可写字段展开成一个列表, 之后的每次绑定都直接调用原型字段的校验方法。
+
+    以下情况无法保证与完整的序列化器行为一致, 回退为每次实例化序列化器:
+        1. 序列化器重写了构造方法、validate、to_internal_value等方法, 或定义了validate_<字段名>方法
+        2. 序列化器级别的校验器 (例如ModelSerializer的unique_together)
+        3. 嵌套的序列化器字段
+        4. 需要上下文的字段校验器或缺省值
+        5. 可变的缺省值 (例如列表)
+
+    validated_data与错误的结构与完整的序列化器相同。
+    """
+
+    def __init__(self, serializer_class):
+        """
+        构造方法
+
+        :param serializer_class: 序列化器类型
+        """
+        self._serializer_class = serializer_class
+        self._fields = None
+        self._set_value = None
+        self.fallback_reason = self._compile()
+
+    @property
+    def serializer_class(self):
+        return self._serializer_class
+
+    @property
+    def compiled(self):
+        """
+        是否使用编译后的快速路径
+        """
+        return self.fallback_reason is None
+
+    def _compile(self):
+        cls = self._serializer_class
+        if not issubclass(cls, serializers.Serializer):
+            return 'not a Serializer subclass'
+
+        for name in _UNSUPPORTED_OVERRIDES:
+            if getattr(cls, name) is not getattr(serializers.Serializer, name):
+                return '%s() is overridden' % name
+
+        # noinspection PyBroadException
+        try:
+            prototype = cls()
+            fields = list(prototype._writable_fields)
+            validators = prototype.validators
+        except Exception:
+            return 'failed to build the prototype serializer'
+
+        if validators:
+            return 'serializer level validators'
+
+        compiled_fields = []
+        for field in fields:
+            reason = self._check_field(cls, field)
+            if reason is not None:
+                return reason
+
+            # 字段的validators是惰性构建的, 在这里构建好, 之后只读
+            _ = field.validators
+
+            # 绝大多数字段读取数据时只是dictionary.get(field_name, empty)
+            get_value = None if type(field).get_value is Field.get_value else field.get_value
+            source_attrs = field.source_attrs
+            source_attr = source_attrs[0] if len(source_attrs) == 1 else None
+            compiled_fields.append((field.field_name, get_value, field.run_validation, source_attrs, source_attr))
+
+        self._fields = compiled_fields
+        self._set_value = prototype.set_value
+        return None
+
+    @staticmethod
+    def _check_field(cls, field):
+        name = field.field_name
+        if isinstance(field, serializers.BaseSerializer):
+            return 'nested serializer field: %s' % name
+        if hasattr(cls, 'validate_' + name):
+            return 'validate_%s() is defined' % name
+        if any(getattr(x, 'requires_context', False) for x in field.validators):
+            return 'context aware validator on field: %s' % name
+        default = field.default
+        if default is not empty:
+            if callable(default):
+                if getattr(default, 'requires_context', False):
+                    return 'context aware default on field: %s' % name
+            elif not isinstance(default, _IMMUTABLE_DEFAULT_TYPES):
+                return 'mutable default on field: %s' % name
+        return None
+
+    def bind(self, data):
+        """
+        校验并绑定数据
+
+        :param data: 待绑定的数据(字典)
+        :return: validated_data
+        :raise ValidationError: 校验失败时抛出, 错误的结构与序列化器的errors相同
+        """
+        # 不是字典的数据交给序列化器产生错误信息
+        if self._fields is None or not isinstance(data, Mapping):
+            serializer = self._serializer_class(data=data)
+            serializer.is_valid(raise_exception=True)
+            return serializer.validated_data
+
+        ret = {}
+        errors = {}
+        for field_name, get_value, run_validation, source_attrs, source_attr in self._fields:
+            primitive_value = data.get(field_name, empty) if get_value is None else get_value(data)
+            try:
+                validated_value = run_validation(primitive_value)
+            except ValidationError as exc:
+                errors[field_name] = exc.detail
+            except DjangoValidationError as exc:
+                errors[field_name] = get_error_detail(exc)
+            except SkipField:
+                pass
+            else:
+                if source_attr is not None:
+                    ret[source_attr] = validated_value
+                else:
+                    self._set_value(ret, source_attrs, validated_value)
+
+        if errors:
+            raise ValidationError(errors)
+        return ret
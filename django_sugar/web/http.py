@@ -9,40 +9,117 @@ r"""
     https://github.com/yingzhuo/django-sugar
 
 """
+import asyncio
+import atexit
+import functools
+import itertools
 import logging
-import re
-from typing import List
-
+import logging.handlers
+import queue
+import random
+import threading
+import time
+from collections.abc import Mapping
+
+from django.conf import settings
+from django.db.models import Manager, QuerySet
+from django.http import StreamingHttpResponse
 from django.utils import deprecation
+from django.utils.datastructures import MultiValueDict
+from rest_framework.compat import LONG_SEPARATORS, SHORT_SEPARATORS
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+
+from django_sugar.web import binder, representation, useragent
 
 
 def merge_client_data(request, *, squeeze=True, default_values: dict = None, **kwargs):
     """
     合并请求提交的数据
 
+    优先级: request.data > request.GET > kwargs > default_values
+    返回的是只读的视图, 不复制底层的数据, 访问时才查找; 需要可修改的字典时请调用其copy方法。
+
     :param request: 请求对象
     :param squeeze: 当结果value包含多个值时，是否只去最后一个值
     :param default_values: 可以设置一些缺省值
     :param kwargs: 其他参数
-    :return: 合并后的数据(字典)
+    :return: 合并后的数据(MergedClientData实例)
+    """
+    return MergedClientData(request.data, request.GET, kwargs, default_values or {}, squeeze=squeeze)
+
+
+_MISSING = object()
+
+
+class MergedClientData(Mapping):
+    """
+    多个数据源合并后的只读视图
+
+    靠前的数据源优先。只有QueryDict等MultiValueDict数据源的值是多值的:
+    squeeze为True时取最后一个值, 否则取全部值 (列表)。
+    其他数据源 (例如JSON请求体) 的值原样返回, JSON中的数组不会被压缩。
+
+    本类没有getlist方法, DRF不会把它当作HTML表单数据处理。
     """
-    default_values = default_values or dict()
 
-    ret = {
-        **default_values,
-        **kwargs,
-        **request.GET,
-        **request.data,
-    }
+    def __init__(self, *sources, squeeze=True):
+        """
+        构造方法
 
-    if squeeze:
-        for k, v in ret.items():
-            if isinstance(v, List):
-                v = list[-1]
-                ret.update({k: v})
+        :param sources: 数据源, 优先级从高到低
+        :param squeeze: 多值数据源是否只取最后一个值
+        """
+        self._sources = sources
+        self._squeeze = squeeze
+        self._keys = None
+        # 空的数据源不参与查找
+        self._lookups = [(x, isinstance(x, MultiValueDict)) for x in sources if x]
+
+    def __getitem__(self, key):
+        for source, multi in self._lookups:
+            if multi:
+                # 直接读取底层的列表, 与MultiValueDict.__getitem__/getlist的结果相同
+                values = dict.get(source, key, _MISSING)
+                if values is not _MISSING:
+                    if not self._squeeze:
+                        return list(values)
+                    return values[-1] if values else []
+            else:
+                value = source.get(key, _MISSING)
+                if value is not _MISSING:
+                    return value
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return any(key in source for source, _ in self._lookups)
+
+    def _get_keys(self):
+        # 顺序与依次解包数据源得到的字典相同
+        if self._keys is None:
+            keys = {}
+            for source in reversed(self._sources):
+                keys.update(dict.fromkeys(source))
+            self._keys = list(keys)
+        return self._keys
+
+    def __iter__(self):
+        return iter(self._get_keys())
+
+    def __len__(self):
+        return len(self._get_keys())
 
-    return ret
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.copy())
+
+    def copy(self):
+        """
+        复制为普通的字典
+
+        :return: 字典
+        """
+        return {k: self[k] for k in self}
 
 
 def bind_request_data(request, serializer_class, *, squeeze=True, default_values: dict = None, **kwargs):
@@ -57,33 +134,92 @@ def bind_request_data(request, serializer_class, *, squeeze=True, default_values
     :return: 合并后的数据(字典)
     """
 
+    # 直接读取合并视图, 不复制请求数据; 序列化器类型只编译一次, 见CompiledBinder
     data = merge_client_data(request, squeeze=squeeze, default_values=default_values, **kwargs)
-    serializer = serializer_class(data=data)
-    serializer.is_valid(raise_exception=True)
-    return serializer.validated_data
+    return binder.get_compiled_binder(serializer_class).bind(data)
 
 
-def serialize_data_to_response(data, serializer_class=None, *, many=False, **kwargs):
+def serialize_data_to_response(data, serializer_class=None, *, many=False, streaming=False, ndjson=False,
+                               chunk_size=2000, **kwargs):
     """
     序列化数据到response对象
 
+    streaming为True时 (仅限many=True), 逐个序列化元素并以JSON数组片段的形式流式输出,
+    内存占用与数据总量无关。QuerySet使用iterator(chunk_size)分批读取, 不缓存结果。
+    流式输出不经过DRF的内容协商, 固定输出JSON。
+
+    many=True且没有其他参数时使用编译后的to_representation, 见representation.compile_serializer。
+
     :param data: 待序列化的数据
     :param serializer_class: 序列化器类型
     :param many: 是否序列化多个元素
-    :return: Response实例
+    :param streaming: 是否流式输出
+    :param ndjson: 流式输出时, 是否输出为NDJSON (每行一个JSON对象) 而不是JSON数组
+    :param chunk_size: 流式输出时, 每批读取和输出的元素个数
+    :return: Response实例, 流式输出时为StreamingHttpResponse实例
     """
 
+    if streaming and many:
+        content_type = 'application/x-ndjson' if ndjson else 'application/json'
+        chunks = _stream_json(data, serializer_class, ndjson=ndjson, chunk_size=chunk_size, **kwargs)
+        return StreamingHttpResponse(chunks, content_type=content_type)
+
     if serializer_class:
-        serializer = serializer_class(instance=data, many=many, **kwargs)
-        data = serializer.data
+        if many and not kwargs:
+            data = representation.represent_many(serializer_class, data)
+        else:
+            serializer = serializer_class(instance=data, many=many, **kwargs)
+            data = serializer.data
     return Response(data=data)
 
 
+def _stream_json(data, serializer_class, *, ndjson, chunk_size, **kwargs):
+    # 与JSONRenderer的默认输出一致
+    encode = encoders.JSONEncoder(ensure_ascii=not api_settings.UNICODE_JSON,
+                                  allow_nan=not api_settings.STRICT_JSON,
+                                  separators=SHORT_SEPARATORS if api_settings.COMPACT_JSON else LONG_SEPARATORS).encode
+    to_representation = None
+    if serializer_class and not kwargs:
+        to_representation = representation.get_compiled_representation(serializer_class)
+    if serializer_class and to_representation is None:
+        to_representation = serializer_class(many=True, **kwargs).child.to_representation
+
+    if isinstance(data, Manager):
+        data = data.all()
+    if isinstance(data, QuerySet):
+        data = data.iterator(chunk_size=chunk_size)
+
+    separator = '\n' if ndjson else ','
+    first = True
+    if not ndjson:
+        yield b'['
+
+    for chunk in iter(functools.partial(_take, iter(data), chunk_size), []):
+        if to_representation is not None:
+            chunk = [to_representation(x) for x in chunk]
+        ret = separator.join([encode(x) for x in chunk])
+        ret = ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+        if ndjson:
+            ret += '\n'
+        elif not first:
+            ret = ',' + ret
+        first = False
+        yield ret.encode()
+
+    if not ndjson:
+        yield b']'
+
+
+def _take(iterator, n):
+    return list(itertools.islice(iterator, n))
+
+
 def maybe_spider(request):
     """
     测试请求是否有可能是有蜘蛛/爬虫发起
 
     本函数参数仅作为参考
+    判断由缺省的UserAgentClassifier完成 (忽略大小写), 需要具体分类时请使用UserAgentClassifier
 
     :param request: 请求对象
     :return: 有可能是爬虫时返回True
@@ -92,10 +228,8 @@ def maybe_spider(request):
     if not user_agent:
         return False
 
-    regex = r"qihoobot|Baiduspider|Googlebot|Googlebot-Mobile|Googlebot-Image|Mediapartners-Google|" \
-            r"Adsbot-Google|Feedfetcher-Google|Yahoo! Slurp|Yahoo! Slurp China|YoudaoBot|Sosospider|" \
-            r"Sogou spider|Sogou web spider|MSNBot|ia_archiver|Tomato Bot"
-    return bool(re.search(regex, user_agent))
+    categories = useragent.get_default_user_agent_classifier().classify(user_agent)
+    return useragent.SEARCH_BOT in categories
 
 
 class HttpRequestDescriptor(object):
@@ -149,15 +283,17 @@ class HttpRequestDescriptor(object):
                 ret.append("\t%s => %s" % (name, content))
 
         # 请求头
-        if len(self.get_headers()) > 0:
+        headers = self.get_headers()
+        if len(headers) > 0:
             ret.append("Headers:")
-            for name, value in self.get_headers().items():
+            for name, value in headers.items():
                 ret.append("\t%s => %s" % (name, value))
 
         # query参数
-        if len(self.get_query_params()):
+        query_params = self.get_query_params()
+        if len(query_params):
             ret.append("Query Dict:")
-            for k, v in self.get_query_params().items():
+            for k, v in query_params.items():
                 ret.append("\t%s => %s" % (k, v))
 
         return ret
@@ -175,12 +311,133 @@ class HttpRequestDescriptor(object):
 class RequestLoggingMiddleware(deprecation.MiddlewareMixin):
     """
     请求日志记录中间件
+
+    每个请求记录一条日志, 请求的详细信息以字典的形式保存在日志记录的http_request属性中。
+    日志级别未启用、未被采样或路径不匹配时不做任何额外的工作。
+
+    默认同步写日志。需要请求线程不等待日志I/O时, 设置use_queue = True
+    或Django配置 DJANGO_SUGAR_REQUEST_LOGGING_USE_QUEUE = True 启用队列:
+    中间件创建时, 本记录器的有效处理器 (自己的处理器与propagate链上所有上级记录器的处理器, 例如root或django上的)
+    被交给后台的QueueListener, 本记录器只保留一个QueueHandler并设置propagate = False,
+    请求线程只把日志记录放入队列。上级记录器本身不做任何修改。
+    提示: 中间件创建之后才添加的处理器不会收到本记录器的日志; 没有任何有效处理器时不启用队列并输出警告。
+    同时支持同步与异步模式, 异步模式下不切换线程。
     """
 
-    def process_request(self, request):
+    # 日志记录器名称
+    logger_name = 'django_sugar.request'
+
+    # 日志级别
+    log_level = logging.DEBUG
+
+    # 采样率 (0 ~ 1)
+    sample_rate = 1.0
+
+    # 只记录这些路径前缀的请求, None表示全部
+    include_paths = None
+
+    # 不记录这些路径前缀的请求
+    exclude_paths = ()
+
+    # 是否记录请求头
+    log_headers = True
+
+    # 是否通过后台线程写日志 (默认不启用), None表示读取Django配置DJANGO_SUGAR_REQUEST_LOGGING_USE_QUEUE
+    use_queue = None
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        # 不使用MiddlewareMixin的async_mode, Django 4.1没有这个属性
+        self._async_get_response = asyncio.iscoroutinefunction(get_response)
+        self._logger = logging.getLogger(self.logger_name)
+        self._include_paths = tuple(self.include_paths) if self.include_paths is not None else None
+        self._exclude_paths = tuple(self.exclude_paths)
+
+        use_queue = self.use_queue
+        if use_queue is None:
+            use_queue = getattr(settings, 'DJANGO_SUGAR_REQUEST_LOGGING_USE_QUEUE', False)
+        if use_queue:
+            _install_queue_handler(self._logger)
+
+    def __call__(self, request):
+        if self._async_get_response:
+            return self.__acall__(request)
+        started = self._begin(request)
+        response = self.get_response(request)
+        if started is not None:
+            self._log(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        started = self._begin(request)
+        response = await self.get_response(request)
+        if started is not None:
+            self._log(request, response, started)
+        return response
+
+    def _begin(self, request):
+        # 返回开始时间, 不需要记录时返回None
+        if not self._logger.isEnabledFor(self.log_level):
+            return None
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None
+        path = request.path
+        if self._include_paths is not None and not path.startswith(self._include_paths):
+            return None
+        if self._exclude_paths and path.startswith(self._exclude_paths):
+            return None
+        return time.perf_counter()
+
+    def _log(self, request, response, started):
+        elapsed_ms = (time.perf_counter() - started) * 1e3
         descriptor = HttpRequestDescriptor(request)
-        logging.debug('-' * 120)
-        for msg in descriptor.get_detail():
-            logging.debug(msg)
-        logging.debug('-' * 120)
-        return self.get_response(request)
+        detail = {
+            **descriptor.get_base_info(),
+            'remote_addr': request.META.get('REMOTE_ADDR'),
+            'query_params': descriptor.get_query_params(),
+            'status_code': response.status_code,
+            'elapsed_ms': round(elapsed_ms, 3),
+        }
+        if self.log_headers:
+            detail['headers'] = descriptor.get_headers()
+
+        self._logger.log(self.log_level, '%s %s %d %.3fms', request.method, request.path, response.status_code,
+                         elapsed_ms, extra={'http_request': detail})
+
+
+_queue_listeners = {}
+_queue_listeners_lock = threading.Lock()
+
+
+def _install_queue_handler(logger):
+    # 每个日志记录器只安装一次
+    with _queue_listeners_lock:
+        if logger.name in _queue_listeners:
+            return
+
+        handlers = _get_effective_handlers(logger)
+        if not handlers:
+            logging.warning("Logger '%s' has no handlers, request logging queue is not installed.", logger.name)
+            return
+
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+
+        # 不再传播给上级记录器, 上级的处理器已经交给listener, 否则同一条日志会在请求线程中再写一次
+        logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+        logger.propagate = False
+        _queue_listeners[logger.name] = listener
+
+
+def _get_effective_handlers(logger):
+    # 与Logger.callHandlers相同的顺序: 先自己, 再沿propagate链向上
+    handlers = []
+    current = logger
+    while current is not None:
+        handlers.extend(x for x in current.handlers if x not in handlers)
+        if not current.propagate:
+            break
+        current = current.parent
+    return handlers
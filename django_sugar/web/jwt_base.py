@@ -146,20 +146,18 @@ class _HMAC(JsonWebTokenSignatureComponent):
         return self._key
 
 
-class _RSA(JsonWebTokenSignatureComponent):
+class _AsymmetricKeyPair(JsonWebTokenSignatureComponent, metaclass=abc.ABCMeta):
+    """
+    非对称算法组件的公共实现
+
+    PEM格式的密钥在构造时解析成cryptography的密钥对象, 错误的密钥或口令在启动时即可发现。
+    没有提供的一侧 (例如只验签时私钥为None) 不会被解析。
+    """
 
     def __init__(self, name, public_key, private_key, passphrase=None):
-        public_key = lang.ensure_bytes(public_key)
-        private_key = lang.ensure_bytes(private_key)
-        passphrase = lang.ensure_bytes(passphrase)
-
-        if passphrase is not None:
-            private_key = serialization.load_pem_private_key(private_key,
-                                                             password=passphrase,
-                                                             backend=default_backend())
         self._name = name
-        self._public_key = public_key
-        self._private_key = private_key
+        self._public_key = _load_public_key(public_key)
+        self._private_key = _load_private_key(private_key, lang.ensure_bytes(passphrase))
 
     @property
     def name(self):
@@ -174,24 +172,25 @@ class _RSA(JsonWebTokenSignatureComponent):
         return self._public_key
 
 
-class _ECDSA(JsonWebTokenSignatureComponent):
+class _RSA(_AsymmetricKeyPair):
+    pass
 
-    def __init__(self, name, public_key, private_key):
-        public_key = lang.ensure_bytes(public_key)
-        private_key = lang.ensure_bytes(private_key)
 
-        self._name = name
-        self._public_key = public_key
-        self._private_key = private_key
+class _ECDSA(_AsymmetricKeyPair):
+    pass
 
-    @property
-    def name(self):
-        return self._name
 
-    @property
-    def encoding_key(self):
-        return self._private_key
+def _load_public_key(key):
+    if key is None or _is_key_object(key):
+        return key
+    return serialization.load_pem_public_key(lang.ensure_bytes(key), backend=default_backend())
 
-    @property
-    def decoding_key(self):
-        return self._public_key
+
+def _load_private_key(key, passphrase):
+    if key is None or _is_key_object(key):
+        return key
+    return serialization.load_pem_private_key(lang.ensure_bytes(key), password=passphrase, backend=default_backend())
+
+
+def _is_key_object(key):
+    return key is not None and not isinstance(key, (str, bytes))
@@ -0,0 +1,425 @@
+r"""
+ ____  _                           ____
+|  _ \(_) __ _ _ __   __ _  ___   / ___| _   _  __ _  __ _ _ __
+| | | | |/ _` | '_ \ / _` |/ _ \  \___ \| | | |/ _` |/ _` | '__|
+| |_| | | (_| | | | | (_| | (_) |  ___) | |_| | (_| | (_| | |
+|____// |\__,_|_| |_|\__, |\___/  |____/ \__,_|\__, |\__,_|_|
+    |__/             |___/                     |___/
+
+    https://github.com/yingzhuo/django-sugar
+
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+import cryptography
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+from django_sugar import VERSION
+from django_sugar.web import jwt_base, token_jwt
+
+# JsonWebTokenSignatureComponent签名算法基准测试
+#
+# 用法:
+#     python -m django_sugar.web.jwt_benchmark --output result.json
+#     python -m django_sugar.web.jwt_benchmark --algorithms hs256,rs256,es256 --compare last.json
+#     python -m django_sugar.web.jwt_benchmark --algorithms rs256,es256 --verify-many --batch-sizes 16,256 --workers 1,4
+#
+# 密钥在本地临时生成, 不会写入磁盘。
+
+_FACTORY_METHODS = [
+    'none',
+    'hs256', 'hs384', 'hs512',
+    'rs256', 'rs384', 'rs512',
+    'ps256', 'ps384', 'ps512',
+    'es256', 'es256k', 'es384', 'es521', 'es512',
+]
+
+_CURVES = {
+    'es256': ec.SECP256R1,
+    'es256k': ec.SECP256K1,
+    'es384': ec.SECP384R1,
+    'es521': ec.SECP521R1,
+    'es512': ec.SECP521R1,
+}
+
+# 令牌大小: 名称 -> payload中额外claim的个数
+_TOKEN_SIZES = {
+    'small': 2,
+    'medium': 20,
+    'large': 200,
+}
+
+
+def create_sign_component(factory_method, *, rsa_key_size=2048):
+    """
+    生成临时密钥并创建签名组件
+
+    :param factory_method: JsonWebTokenSignatureComponent的工厂方法名
+    :param rsa_key_size: RSA密钥长度
+    :return: JsonWebTokenSignatureComponent实例
+    """
+    factory = getattr(jwt_base.JsonWebTokenSignatureComponent, factory_method)
+
+    if factory_method == 'none':
+        return factory()
+
+    if factory_method.startswith('hs'):
+        return factory(os.urandom(32).hex())
+
+    if factory_method.startswith(('rs', 'ps')):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=rsa_key_size)
+    else:
+        private_key = ec.generate_private_key(_CURVES[factory_method]())
+
+    private_pem = private_key.private_bytes(serialization.Encoding.PEM,
+                                            serialization.PrivateFormat.PKCS8,
+                                            serialization.NoEncryption())
+    public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                       serialization.PublicFormat.SubjectPublicKeyInfo)
+    return factory(public_pem, private_pem)
+
+
+def create_payload(num_claims):
+    payload = {
+        'sub': '10000',
+        'iat': int(time.time()),
+        'exp': int(time.time()) + 3600,
+    }
+    for i in range(num_claims):
+        payload['claim_%03d' % i] = 'value-%03d' % i
+    return payload
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _run(func, args_list, concurrency):
+    """
+    以指定的并发数执行func, 返回 (总耗时纳秒, 每次调用耗时纳秒列表)
+    """
+    latencies = []
+    lock = threading.Lock()
+    chunks = [args_list[i::concurrency] for i in range(concurrency)]
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(chunk):
+        local = []
+        barrier.wait()
+        for args in chunk:
+            started = time.perf_counter_ns()
+            func(args)
+            local.append(time.perf_counter_ns() - started)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(x,)) for x in chunks]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    started = time.perf_counter_ns()
+    for t in threads:
+        t.join()
+    return time.perf_counter_ns() - started, latencies
+
+
+def _summarize(elapsed_ns, latencies):
+    latencies.sort()
+    return {
+        'operations': len(latencies),
+        'ops_per_second': round(len(latencies) / (elapsed_ns / 1e9), 1),
+        'latency_us': {
+            'mean': round(sum(latencies) / len(latencies) / 1e3, 2),
+            'p50': round(_percentile(latencies, 50) / 1e3, 2),
+            'p90': round(_percentile(latencies, 90) / 1e3, 2),
+            'p99': round(_percentile(latencies, 99) / 1e3, 2),
+            'max': round(latencies[-1] / 1e3, 2),
+        },
+    }
+
+
+def benchmark_component(factory_method, sign_component, *, token_size, concurrency, iterations):
+    """
+    测试一个签名组件在指定令牌大小与并发数下的签名/验签性能
+
+    :return: 字典
+    """
+    minter = token_jwt.JwtTokenMinter(sign_component)
+
+    class _Finder(token_jwt.JwtTokenBasedUserFinder):
+        jwt_sign_component = sign_component
+        jwt_verify_signature = sign_component.name != 'none'
+
+    finder = _Finder()
+    payload = create_payload(_TOKEN_SIZES[token_size])
+    tokens = [minter.mint(payload) for _ in range(min(iterations, 64))]
+
+    # 预热
+    for x in tokens[:8]:
+        finder.verify_token(x)
+
+    sign_elapsed, sign_latencies = _run(minter.mint, [payload] * iterations, concurrency)
+    verify_args = [tokens[i % len(tokens)] for i in range(iterations)]
+    verify_elapsed, verify_latencies = _run(finder.verify_token, verify_args, concurrency)
+
+    return {
+        'factory_method': factory_method,
+        'algorithm': sign_component.name,
+        'token_size': token_size,
+        'token_bytes': len(tokens[0]),
+        'concurrency': concurrency,
+        'sign': _summarize(sign_elapsed, sign_latencies),
+        'verify': _summarize(verify_elapsed, verify_latencies),
+    }
+
+
+def benchmark_verify_many(factory_method, sign_component, *, token_size, batch_size, max_workers, iterations):
+    """
+    测试JwtTokenBasedUserFinder.verify_many在指定批大小与线程数下的吞吐量
+
+    同时测量逐个调用verify_token验证同一批令牌的耗时, 作为对比。
+    批内的令牌各不相同 (verify_many会对相同的令牌去重)。
+
+    :return: 字典
+    """
+    minter = token_jwt.JwtTokenMinter(sign_component)
+
+    class _Finder(token_jwt.JwtTokenBasedUserFinder):
+        jwt_sign_component = sign_component
+        jwt_verify_signature = sign_component.name != 'none'
+
+    finder = _Finder()
+    payload = create_payload(_TOKEN_SIZES[token_size])
+    tokens = [minter.mint(dict(payload, jti=str(i))) for i in range(batch_size)]
+    rounds = max(1, iterations // batch_size)
+
+    # 预热, 同时创建线程池
+    finder.verify_many(tokens[:max_workers * 2], max_workers=max_workers)
+
+    batch_latencies = []
+    started = time.perf_counter_ns()
+    for _ in range(rounds):
+        batch_started = time.perf_counter_ns()
+        finder.verify_many(tokens, max_workers=max_workers)
+        batch_latencies.append(time.perf_counter_ns() - batch_started)
+    elapsed = time.perf_counter_ns() - started
+
+    sequential_started = time.perf_counter_ns()
+    for _ in range(rounds):
+        for x in tokens:
+            finder.verify_token(x)
+    sequential_elapsed = time.perf_counter_ns() - sequential_started
+
+    summary = _summarize(elapsed, batch_latencies)
+    operations = rounds * batch_size
+    return {
+        'factory_method': factory_method,
+        'algorithm': sign_component.name,
+        'token_size': token_size,
+        'token_bytes': len(tokens[0]),
+        'batch_size': batch_size,
+        'max_workers': max_workers,
+        'batches': rounds,
+        'tokens_per_second': round(operations / (elapsed / 1e9), 1),
+        'sequential_tokens_per_second': round(operations / (sequential_elapsed / 1e9), 1),
+        'speedup': round(sequential_elapsed / elapsed, 2),
+        'batch_latency_us': summary['latency_us'],
+    }
+
+
+def run_benchmark(*, factory_methods=None, token_sizes=None, concurrency_levels=(1,), iterations=500,
+                  rsa_key_size=2048, progress=None, batch_sizes=None, verify_workers=(1,)):
+    """
+    运行基准测试
+
+    :param factory_methods: 要测试的工厂方法名列表, 默认为全部
+    :param token_sizes: 要测试的令牌大小列表 (small, medium, large), 默认为全部
+    :param concurrency_levels: 要测试的并发数列表
+    :param iterations: 每项测试的签名/验签次数
+    :param rsa_key_size: RSA密钥长度
+    :param progress: 进度回调函数, 参数为每项测试的结果
+    :param batch_sizes: verify_many测试的批大小列表, 默认不测试verify_many
+    :param verify_workers: verify_many测试的线程数列表
+    :return: 可以序列化为JSON的字典
+    """
+    factory_methods = factory_methods or _FACTORY_METHODS
+    token_sizes = token_sizes or list(_TOKEN_SIZES)
+
+    results = []
+    verify_many_results = []
+    for factory_method in factory_methods:
+        sign_component = create_sign_component(factory_method, rsa_key_size=rsa_key_size)
+        for token_size in token_sizes:
+            for concurrency in concurrency_levels:
+                result = benchmark_component(factory_method,
+                                             sign_component,
+                                             token_size=token_size,
+                                             concurrency=concurrency,
+                                             iterations=iterations)
+                results.append(result)
+                if progress is not None:
+                    progress(result)
+
+            for batch_size in batch_sizes or ():
+                for max_workers in verify_workers:
+                    result = benchmark_verify_many(factory_method,
+                                                   sign_component,
+                                                   token_size=token_size,
+                                                   batch_size=batch_size,
+                                                   max_workers=max_workers,
+                                                   iterations=iterations)
+                    verify_many_results.append(result)
+                    if progress is not None:
+                        progress(result)
+
+    return {
+        'meta': {
+            'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'django_sugar': VERSION,
+            'pyjwt': jwt.__version__,
+            'cryptography': cryptography.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'iterations': iterations,
+            'rsa_key_size': rsa_key_size,
+        },
+        'results': results,
+        'verify_many': verify_many_results,
+    }
+
+
+def compare_results(baseline, current):
+    """
+    比较两次测试结果
+
+    :param baseline: 基准结果 (run_benchmark的返回值)
+    :param current: 当前结果
+    :return: 列表, 每个元素为 (测试项名称, 操作, 基准ops, 当前ops, 比值)
+    """
+
+    def key(x):
+        return x['factory_method'], x['token_size'], x['concurrency']
+
+    baseline_results = {key(x): x for x in baseline['results']}
+    ret = []
+    for result in current['results']:
+        old = baseline_results.get(key(result))
+        if old is None:
+            continue
+        for op in ('sign', 'verify'):
+            old_ops = old[op]['ops_per_second']
+            new_ops = result[op]['ops_per_second']
+            ret.append(('%s/%s/c%d' % key(result), op, old_ops, new_ops, new_ops / old_ops if old_ops else None))
+
+    def verify_many_key(x):
+        return x['factory_method'], x['token_size'], x['batch_size'], x['max_workers']
+
+    baseline_results = {verify_many_key(x): x for x in baseline.get('verify_many', ())}
+    for result in current.get('verify_many', ()):
+        old = baseline_results.get(verify_many_key(result))
+        if old is None:
+            continue
+        old_ops = old['tokens_per_second']
+        new_ops = result['tokens_per_second']
+        ret.append(('%s/%s/b%d/w%d' % verify_many_key(result), 'many', old_ops, new_ops,
+                    new_ops / old_ops if old_ops else None))
+    return ret
+
+
+def _format_result(result):
+    if 'batch_size' in result:
+        return '%-7s %-6s %5dB b=%-4d w=%-2d  verify_many %9.1f/s  sequential %9.1f/s  %.2fx  batch p99 %9.1fus' % (
+            result['factory_method'],
+            result['token_size'],
+            result['token_bytes'],
+            result['batch_size'],
+            result['max_workers'],
+            result['tokens_per_second'],
+            result['sequential_tokens_per_second'],
+            result['speedup'],
+            result['batch_latency_us']['p99'],
+        )
+    return '%-7s %-6s %5dB c=%-2d  sign %9.1f/s p99 %8.1fus  verify %9.1f/s p99 %8.1fus' % (
+        result['factory_method'],
+        result['token_size'],
+        result['token_bytes'],
+        result['concurrency'],
+        result['sign']['ops_per_second'],
+        result['sign']['latency_us']['p99'],
+        result['verify']['ops_per_second'],
+        result['verify']['latency_us']['p99'],
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m django_sugar.web.jwt_benchmark',
+                                     description='Benchmark JsonWebTokenSignatureComponent algorithms.')
+    parser.add_argument('--algorithms', default=','.join(_FACTORY_METHODS),
+                        help='comma separated factory methods (default: all)')
+    parser.add_argument('--token-sizes', default=','.join(_TOKEN_SIZES),
+                        help='comma separated token sizes: %s' % ','.join(_TOKEN_SIZES))
+    parser.add_argument('--concurrency', default='1,4', help='comma separated thread counts (default: 1,4)')
+    parser.add_argument('--iterations', type=int, default=500, help='operations per measurement (default: 500)')
+    parser.add_argument('--rsa-key-size', type=int, default=2048, help='RSA key size (default: 2048)')
+    parser.add_argument('--verify-many', action='store_true', help='also benchmark verify_many batches')
+    parser.add_argument('--batch-sizes', default='1,16,256',
+                        help='comma separated verify_many batch sizes (default: 1,16,256)')
+    parser.add_argument('--workers', default='1,2,4,8',
+                        help='comma separated verify_many worker counts (default: 1,2,4,8)')
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--compare', help='compare with a previous JSON result file')
+    args = parser.parse_args(argv)
+
+    factory_methods = [x.strip().lower() for x in args.algorithms.split(',') if x.strip()]
+    unknown = [x for x in factory_methods if x not in _FACTORY_METHODS]
+    if unknown:
+        parser.error('unknown algorithms: %s' % ', '.join(unknown))
+
+    token_sizes = [x.strip() for x in args.token_sizes.split(',') if x.strip()]
+    unknown = [x for x in token_sizes if x not in _TOKEN_SIZES]
+    if unknown:
+        parser.error('unknown token sizes: %s' % ', '.join(unknown))
+
+    concurrency_levels = [int(x) for x in args.concurrency.split(',') if x.strip()]
+    batch_sizes = [int(x) for x in args.batch_sizes.split(',') if x.strip()] if args.verify_many else None
+    verify_workers = [int(x) for x in args.workers.split(',') if x.strip()]
+
+    report = run_benchmark(factory_methods=factory_methods,
+                           token_sizes=token_sizes,
+                           concurrency_levels=concurrency_levels,
+                           iterations=args.iterations,
+                           rsa_key_size=args.rsa_key_size,
+                           batch_sizes=batch_sizes,
+                           verify_workers=verify_workers,
+                           progress=lambda x: print(_format_result(x), flush=True))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print()
+        for name, op, old_ops, new_ops, ratio in compare_results(baseline, report):
+            print('%-24s %-6s %10.1f -> %10.1f  (%s)' % (
+                name, op, old_ops, new_ops, 'n/a' if ratio is None else '%.2fx' % ratio))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
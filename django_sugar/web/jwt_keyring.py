@@ -0,0 +1,307 @@
+r"""
+ ____  _                           ____
+|  _ \(_) __ _ _ __   __ _  ___   / ___| _   _  __ _  __ _ _ __
+| | | | |/ _` | '_ \ / _` |/ _ \  \___ \| | | |/ _` |/ _` | '__|
+| |_| | | (_| | | | | (_| | (_) |  ___) | |_| | (_| | (_| | |
+|____// |\__,_|_| |_|\__, |\___/  |____/ \__,_|\__, |\__,_|_|
+    |__/             |___/                     |___/
+
+    https://github.com/yingzhuo/django-sugar
+
+"""
+import json
+import logging
+import os
+import threading
+
+import jwt
+from jwt import exceptions
+
+from django_sugar.web import jwt_base
+
+
+class JsonWebTokenKeyRing(object):
+    """
+    JWT密钥环
+
+    持有多个JsonWebTokenSignatureComponent, 以kid为索引。
+    验签时根据令牌头部(未验证)的kid直接选出对应的组件, 不逐个尝试。
+
+    更新密钥时整体替换内部的字典, 读操作无需加锁。
+    每次更新密钥时version加一, 已验证令牌缓存据此丢弃用旧密钥验证的结果。
+    """
+
+    def __init__(self, components=None, *, signing_kid=None, default_kid=None):
+        """
+        构造方法
+
+        :param components: 字典 kid -> JsonWebTokenSignatureComponent
+        :param signing_kid: 生成令牌时使用的kid
+        :param default_kid: 令牌头部没有kid时使用的kid, 默认为None表示拒绝此类令牌
+        """
+        self._components = dict(components or {})
+        self._version = 0
+        self._lock = threading.Lock()
+        self._watcher = None
+        self.signing_kid = signing_kid
+        self.default_kid = default_kid
+
+    def __len__(self):
+        return len(self._components)
+
+    def __iter__(self):
+        return iter(self._components)
+
+    def __contains__(self, kid):
+        return kid in self._components
+
+    def __getitem__(self, kid):
+        return self._components[kid]
+
+    def get(self, kid, default=None):
+        return self._components.get(kid, default)
+
+    def add(self, kid, component):
+        """
+        添加或替换一个密钥
+
+        :param kid: 密钥ID
+        :param component: JsonWebTokenSignatureComponent实例
+        """
+        with self._lock:
+            components = dict(self._components)
+            components[kid] = component
+            self._components = components
+            self._version += 1
+
+    def remove(self, kid):
+        """
+        移除一个密钥
+
+        :param kid: 密钥ID
+        """
+        with self._lock:
+            components = dict(self._components)
+            components.pop(kid, None)
+            self._components = components
+            self._version += 1
+
+    def replace(self, components):
+        """
+        整体替换所有密钥
+
+        :param components: 字典 kid -> JsonWebTokenSignatureComponent
+        """
+        with self._lock:
+            self._components = dict(components)
+            self._version += 1
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def signing_component(self):
+        if self.signing_kid is None:
+            return None
+        return self._components.get(self.signing_kid)
+
+    def select(self, jwt_token):
+        """
+        根据令牌头部的kid选择验签组件
+
+        :param jwt_token: 令牌
+        :return: JsonWebTokenSignatureComponent实例
+        """
+        kid = jwt.get_unverified_header(jwt_token).get('kid', self.default_kid)
+        if kid is None:
+            raise exceptions.InvalidSignatureError('Token has no kid.')
+
+        component = self._components.get(kid)
+        if component is None:
+            raise exceptions.InvalidSignatureError("Unknown kid: '%s'." % kid)
+        return component
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def from_jwks(jwks, **kwargs):
+        """
+        从JWKS创建密钥环
+
+        :param jwks: JWKS (字典或JSON字符串)
+        :return: 密钥环
+        """
+        return JsonWebTokenKeyRing(_parse_jwks(jwks), **kwargs)
+
+    @staticmethod
+    def from_jwks_file(path, *, reload_interval=None, **kwargs):
+        """
+        从本地JWKS文件或目录创建密钥环
+
+        目录中的每个'.json'文件可以是一个JWKS或者单个JWK。
+
+        :param path: 文件或目录
+        :param reload_interval: 检查文件修改时间的间隔 (秒), None表示不自动重新加载
+        :return: 密钥环
+        """
+        ring = JsonWebTokenKeyRing(_load_jwks_path(path), **kwargs)
+        if reload_interval:
+            ring.start_watching(path, reload_interval)
+        return ring
+
+    def reload(self, path):
+        """
+        从本地JWKS文件或目录重新加载全部密钥
+
+        :param path: 文件或目录
+        """
+        self.replace(_load_jwks_path(path))
+
+    def start_watching(self, path, interval=30):
+        """
+        启动后台线程, 文件修改时间变化时重新加载密钥
+
+        :param path: 文件或目录
+        :param interval: 检查间隔 (秒)
+        """
+        self.stop_watching()
+        self._watcher = _JwksFileWatcher(self, path, interval)
+        self._watcher.start()
+
+    def stop_watching(self):
+        """
+        停止后台重新加载线程
+        """
+        watcher, self._watcher = self._watcher, None
+        if watcher is not None:
+            watcher.stop()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class _JWK(jwt_base.JsonWebTokenSignatureComponent):
+
+    def __init__(self, name, key):
+        self._name = name
+        self._encoding_key = key
+        # 私钥无法用于验签, 需要取出对应的公钥
+        public_key = getattr(key, 'public_key', None)
+        self._decoding_key = public_key() if callable(public_key) else key
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def encoding_key(self):
+        return self._encoding_key
+
+    @property
+    def decoding_key(self):
+        return self._decoding_key
+
+
+# 没有alg时根据kty/crv确定的缺省算法, 与PyJWK的规则相同
+_DEFAULT_JWK_ALGORITHMS = {
+    ('EC', 'P-256'): 'ES256',
+    ('EC', 'P-384'): 'ES384',
+    ('EC', 'P-521'): 'ES512',
+    ('EC', 'secp256k1'): 'ES256K',
+    ('RSA', None): 'RS256',
+    ('oct', None): 'HS256',
+    ('OKP', None): 'EdDSA',
+}
+
+
+def _get_jwk_algorithm(jwk_data):
+    alg = jwk_data.get('alg')
+    if alg:
+        return alg
+
+    kty = jwk_data.get('kty')
+    alg = _DEFAULT_JWK_ALGORITHMS.get((kty, jwk_data.get('crv') if kty == 'EC' else None))
+    if alg is None:
+        raise exceptions.PyJWKError('Unable to find an algorithm for key: %s' % jwk_data.get('kid'))
+    return alg
+
+
+def _parse_jwk(jwk_data):
+    # 不使用PyJWK.algorithm_name, 旧版本的PyJWT没有这个属性
+    alg = _get_jwk_algorithm(jwk_data)
+    jwk = jwt.PyJWK(jwk_data, algorithm=alg)
+    return _JWK(alg, jwk.key)
+
+
+def _parse_jwks(jwks, *, default_kid=None):
+    if isinstance(jwks, (str, bytes)):
+        jwks = json.loads(jwks)
+
+    if 'keys' in jwks:
+        keys = jwks['keys']
+    else:
+        keys = [jwks]
+
+    ret = {}
+    for jwk_data in keys:
+        if jwk_data.get('use', 'sig') != 'sig':
+            continue
+        kid = jwk_data.get('kid', default_kid)
+        if kid is None:
+            continue
+        ret[kid] = _parse_jwk(jwk_data)
+    return ret
+
+
+def _list_jwks_files(path):
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, x) for x in os.listdir(path) if x.endswith('.json'))
+    else:
+        return [path]
+
+
+def _load_jwks_path(path):
+    ret = {}
+    for filename in _list_jwks_files(path):
+        with open(filename, 'rb') as f:
+            # 目录中的单个JWK没有kid时, 使用文件名作为kid
+            default_kid = os.path.splitext(os.path.basename(filename))[0] if filename != path else None
+            ret.update(_parse_jwks(f.read(), default_kid=default_kid))
+    return ret
+
+
+def _stat_jwks_path(path):
+    ret = []
+    for filename in _list_jwks_files(path):
+        try:
+            st = os.stat(filename)
+            ret.append((filename, st.st_mtime_ns, st.st_size))
+        except OSError:
+            ret.append((filename, None, None))
+    return tuple(ret)
+
+
+class _JwksFileWatcher(threading.Thread):
+
+    def __init__(self, ring, path, interval):
+        super().__init__(name='jwks-watcher', daemon=True)
+        self._ring = ring
+        self._path = path
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._last_stat = _stat_jwks_path(path)
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            # noinspection PyBroadException
+            try:
+                current_stat = _stat_jwks_path(self._path)
+                if current_stat != self._last_stat:
+                    self._ring.reload(self._path)
+                    self._last_stat = current_stat
+            except Exception:
+                # 加载失败时保留原有的密钥, 等待下一次检查
+                logging.exception("Cannot reload JWKS from '%s'.", self._path)
@@ -10,11 +10,40 @@ r"""
 
 """
 import abc
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
 import re
+import threading
+import time
+from concurrent import futures
+from types import MappingProxyType
+
+from asgiref.sync import sync_to_async
 
 from django_sugar import lang
 
 
+class PasswordEncoderException(Exception):
+    """
+    密码编码器异常
+    """
+
+
+class HashingExecutorSaturatedException(PasswordEncoderException):
+    """
+    哈希线程池已满, 拒绝新的任务
+    """
+
+
+class HashingTimeoutException(PasswordEncoderException):
+    """
+    哈希计算超时
+    """
+
+
 class PasswordEncoder(object, metaclass=abc.ABCMeta):
 
     @abc.abstractmethod
@@ -36,6 +65,27 @@ class PasswordEncoder(object, metaclass=abc.ABCMeta):
         """
         return self.encode_password(raw_password) == encoded_password
 
+    async def apassword_matches(self, raw_password, encoded_password):
+        """
+        比较密码原文和密文是否匹配 (异步)
+
+        默认实现在线程中调用password_matches
+
+        :param raw_password: 密码原文
+        :param encoded_password: 密码密文
+        :return: 匹配时返回True，否则返回False
+        """
+        return await sync_to_async(self.password_matches, thread_sensitive=False)(raw_password, encoded_password)
+
+    def needs_rehash(self, encoded_password):
+        """
+        判断密文的计算强度是否低于当前的设置, 需要在用户下次登录成功时重新加密
+
+        :param encoded_password: 密码密文
+        :return: 结果
+        """
+        return False
+
 
 class NoopPasswordEncoder(PasswordEncoder):
     ignore_cases = None
@@ -117,6 +167,324 @@ _INNER_ENCODERS = {
     'reverse': ReversePasswordEncoder(),
 }
 
+# ----------------------------------------------------------------------------------------------------------------------
+
+class HashingExecutor(object):
+    """
+    慢哈希 (bcrypt等) 专用的有界执行器
+
+    正在执行与排队的任务总数不超过 max_workers + max_pending, 超出时立即拒绝
+    (抛出HashingExecutorSaturatedException), 避免登录高峰占满所有请求线程。
+    bcrypt计算时会释放GIL, 默认使用线程池; 也可以使用进程池。
+
+    排队等待时间可以通过stats查看, 也可以写入AuthMetricsSink (阶段名称为hashing_wait)。
+    """
+
+    def __init__(self, *, max_workers=4, max_pending=64, timeout=5.0, use_processes=False, metrics_sink=None):
+        """
+        构造方法
+
+        :param max_workers: 工作线程 (进程) 数
+        :param max_pending: 排队任务数上限
+        :param timeout: 默认的超时时间 (秒), None表示不超时
+        :param use_processes: 是否使用进程池
+        :param metrics_sink: AuthMetricsSink实例, 默认不采集
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.use_processes = use_processes
+        self.metrics_sink = metrics_sink
+        self._permits = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._wait_count = 0
+        self._wait_total_ns = 0
+        self._wait_max_ns = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.use_processes:
+                        self._executor = futures.ProcessPoolExecutor(max_workers=self.max_workers)
+                    else:
+                        self._executor = futures.ThreadPoolExecutor(max_workers=self.max_workers,
+                                                                    thread_name_prefix='password-hashing')
+        return self._executor
+
+    def submit(self, fn, *args):
+        """
+        提交任务
+
+        :param fn: 函数, 使用进程池时必须可以被pickle
+        :param args: 参数
+        :return: Future实例, 结果为函数的返回值
+        """
+        if not self._permits.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HashingExecutorSaturatedException('Hashing executor is saturated.')
+
+        with self._lock:
+            self._submitted += 1
+        try:
+            inner = self._get_executor().submit(_timed_call, fn, args, time.monotonic_ns())
+        except BaseException:
+            with self._lock:
+                self._submitted -= 1
+            self._permits.release()
+            raise
+
+        ret = futures.Future()
+        inner.add_done_callback(lambda f: self._on_done(f, ret))
+        return ret
+
+    def _on_done(self, inner, outer):
+        self._permits.release()
+        try:
+            wait_ns, result = inner.result()
+        except BaseException as exc:
+            with self._lock:
+                self._completed += 1
+            outer.set_exception(exc)
+            return
+
+        with self._lock:
+            self._completed += 1
+            self._wait_count += 1
+            self._wait_total_ns += wait_ns
+            self._wait_max_ns = max(self._wait_max_ns, wait_ns)
+        if self.metrics_sink is not None:
+            self.metrics_sink.record_timing('hashing_wait', wait_ns)
+        outer.set_result(result)
+
+    def call(self, fn, *args, timeout=None):
+        """
+        执行任务并等待结果
+
+        :param fn: 函数
+        :param args: 参数
+        :param timeout: 超时时间 (秒), 默认为构造时指定的timeout
+        :return: 函数的返回值
+        """
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except futures.TimeoutError:
+            self._on_timeout()
+            raise HashingTimeoutException('Hashing timed out.')
+
+    async def acall(self, fn, *args, timeout=None):
+        """
+        执行任务并等待结果 (异步)
+
+        :param fn: 函数
+        :param args: 参数
+        :param timeout: 超时时间 (秒), 默认为构造时指定的timeout
+        :return: 函数的返回值
+        """
+        future = asyncio.wrap_future(self.submit(fn, *args))
+        try:
+            # shield: 超时只是不再等待, 已经开始的计算无法中断
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            self._on_timeout()
+            raise HashingTimeoutException('Hashing timed out.')
+
+    def _on_timeout(self):
+        with self._lock:
+            self._timeouts += 1
+
+    @property
+    def stats(self):
+        """
+        统计数据
+
+        queued: 排队中的任务数
+        running: 执行中的任务数
+        wait_avg_ns / wait_max_ns: 排队等待时间 (纳秒)
+        """
+        with self._lock:
+            in_flight = self._submitted - self._completed
+            return {
+                'max_workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'queued': max(0, in_flight - self.max_workers),
+                'running': min(in_flight, self.max_workers),
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'timeouts': self._timeouts,
+                'wait_avg_ns': self._wait_total_ns // self._wait_count if self._wait_count else 0,
+                'wait_max_ns': self._wait_max_ns,
+            }
+
+    def shutdown(self, wait=True):
+        """
+        关闭执行器
+
+        :param wait: 是否等待正在执行的任务
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def _timed_call(fn, args, submitted_ns):
+    # 在工作线程 (进程) 中执行, 返回 (排队等待时间, 结果)
+    # Linux等平台的monotonic时钟在进程间一致
+    wait_ns = max(0, time.monotonic_ns() - submitted_ns)
+    return wait_ns, fn(*args)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class _KdfPasswordEncoder(PasswordEncoder, metaclass=abc.ABCMeta):
+    """
+    基于hashlib密钥派生函数的密码编码器
+
+    密文格式为 '$算法$参数$盐$摘要', 盐与摘要使用不带填充的base64编码。
+    """
+
+    # 哈希执行器 (HashingExecutor实例), 默认为None表示在当前线程中计算
+    hashing_executor = None
+
+    # 盐的字节数
+    salt_size = 16
+
+    # 摘要的字节数
+    digest_size = 32
+
+    @property
+    @abc.abstractmethod
+    def algorithm_name(self):
+        """
+        密文中的算法名称
+        """
+
+    @abc.abstractmethod
+    def _get_params(self):
+        """
+        :return: 当前设置的参数 (字典)
+        """
+
+    @abc.abstractmethod
+    def _derive(self, raw_password, salt, params, digest_size):
+        """
+        计算摘要
+
+        :return: 摘要 (bytes)
+        """
+
+    def _call(self, fn, *args):
+        if self.hashing_executor is not None:
+            return self.hashing_executor.call(fn, *args)
+        return fn(*args)
+
+    def encode_password(self, raw_password):
+        salt = os.urandom(self.salt_size)
+        params = self._get_params()
+        digest = self._call(self._derive, raw_password.encode('utf-8'), salt, params, self.digest_size)
+        return '$%s$%s$%s$%s' % (self.algorithm_name,
+                                 ','.join('%s=%d' % x for x in params.items()),
+                                 _b64encode(salt),
+                                 _b64encode(digest))
+
+    def password_matches(self, raw_password, encoded_password):
+        parsed = self._parse(encoded_password)
+        if parsed is None:
+            return False
+        params, salt, digest = parsed
+        actual = self._call(self._derive, raw_password.encode('utf-8'), salt, params, len(digest))
+        return hmac.compare_digest(actual, digest)
+
+    def needs_rehash(self, encoded_password):
+        parsed = self._parse(encoded_password)
+        if parsed is None:
+            return True
+        params = parsed[0]
+        return any(params.get(k, 0) < v for k, v in self._get_params().items())
+
+    def _parse(self, encoded_password):
+        parts = encoded_password.split('$')
+        if len(parts) != 5 or parts[0] or parts[1] != self.algorithm_name:
+            return None
+        try:
+            params = {k: int(v) for k, v in (x.split('=', 1) for x in parts[2].split(','))}
+            return params, _b64decode(parts[3]), _b64decode(parts[4])
+        except ValueError:
+            return None
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+
+def _b64decode(string):
+    return base64.b64decode(string + '=' * (-len(string) % 4))
+
+
+class ScryptPasswordEncoder(_KdfPasswordEncoder):
+    """
+    scrypt密码编码器
+
+    内存占用约为 128 * n * r 字节。
+    """
+
+    algorithm_name = 'scrypt'
+
+    # CPU/内存开销参数, 必须是2的幂
+    n = 2 ** 14
+
+    # 块大小
+    r = 8
+
+    # 并行度
+    p = 1
+
+    def _get_params(self):
+        return {'ln': self.n.bit_length() - 1, 'r': self.r, 'p': self.p}
+
+    @staticmethod
+    def _derive(raw_password, salt, params, digest_size):
+        n, r, p = 1 << params['ln'], params['r'], params['p']
+        return hashlib.scrypt(raw_password, salt=salt, n=n, r=r, p=p, dklen=digest_size,
+                              maxmem=128 * r * (n + p + 2) + (1 << 20))
+
+
+class Pbkdf2PasswordEncoder(_KdfPasswordEncoder):
+    """
+    PBKDF2-HMAC-SHA256密码编码器
+    """
+
+    algorithm_name = 'pbkdf2-sha256'
+
+    # 迭代次数
+    iterations = 600000
+
+    def _get_params(self):
+        return {'i': self.iterations}
+
+    @staticmethod
+    def _derive(raw_password, salt, params, digest_size):
+        return hashlib.pbkdf2_hmac('sha256', raw_password, salt, params['i'], dklen=digest_size)
+
+
+_INNER_ENCODERS.update(
+    {
+        'scrypt': ScryptPasswordEncoder(),
+        'pbkdf2': Pbkdf2PasswordEncoder(),
+    }
+)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
 # noinspection PyBroadException
 try:
     import bcrypt
@@ -124,16 +492,43 @@ try:
 
     class BcryptPasswordEncoder(PasswordEncoder):
 
+        # 哈希执行器 (HashingExecutor实例), 默认为None表示在当前线程中计算
+        # 提示: 执行器在类上共享
+        hashing_executor = None
+
+        # 计算强度 (4 ~ 31), 每加1计算时间翻倍
+        rounds = 6
+
         def encode_password(self, raw_password):
-            salt = bcrypt.gensalt(rounds=6)
-            byte_array = bcrypt.hashpw(raw_password.encode('utf-8'), salt)
+            salt = bcrypt.gensalt(rounds=self.rounds)
+            raw_password = raw_password.encode('utf-8')
+            if self.hashing_executor is not None:
+                byte_array = self.hashing_executor.call(bcrypt.hashpw, raw_password, salt)
+            else:
+                byte_array = bcrypt.hashpw(raw_password, salt)
             return str(byte_array, 'utf-8')
 
         def password_matches(self, raw_password, encoded_password):
             raw_password = raw_password.encode('utf-8')
             encoded_password = encoded_password.encode('utf-8')
+            if self.hashing_executor is not None:
+                return self.hashing_executor.call(bcrypt.checkpw, raw_password, encoded_password)
             return bcrypt.checkpw(raw_password, encoded_password)
 
+        async def apassword_matches(self, raw_password, encoded_password):
+            if self.hashing_executor is None:
+                return await super().apassword_matches(raw_password, encoded_password)
+            raw_password = raw_password.encode('utf-8')
+            encoded_password = encoded_password.encode('utf-8')
+            return await self.hashing_executor.acall(bcrypt.checkpw, raw_password, encoded_password)
+
+        def needs_rehash(self, encoded_password):
+            # 格式: $2b$06$...
+            parts = encoded_password.split('$', 3)
+            if len(parts) != 4 or not parts[2].isdigit():
+                return True
+            return int(parts[2]) < self.rounds
+
 
     _INNER_ENCODERS.update(
         {
@@ -146,37 +541,292 @@ except Exception:
     _BCRYPT_PRESENT = False
 
 
+class WrappingPasswordEncoder(PasswordEncoder):
+    """
+    包装型密码编码器
+
+    密文为 outer(inner(密码原文))。用于批量迁移旧的快速哈希 (md5/sha1等):
+    无需知道密码原文, 直接用慢哈希包装已有的摘要即可, 例如 '{md5}xxx' -> '{bcrypt_md5}' + bcrypt('xxx')。
+    用户下次登录成功时, DelegatingPasswordEncoder.needs_rehash会返回True, 此时再换成普通的密文。
+    """
+
+    def __init__(self, outer, inner):
+        """
+        构造方法
+
+        :param outer: 外层编码器 (慢哈希)
+        :param inner: 内层编码器 (必须是确定性的, 相同的原文总是得到相同的密文)
+        """
+        self.outer = outer
+        self.inner = inner
+
+    def encode_password(self, raw_password):
+        return self.wrap(self.inner.encode_password(raw_password))
+
+    def wrap(self, inner_encoded_password):
+        """
+        包装内层编码器的密文
+
+        :param inner_encoded_password: 内层编码器的密文
+        :return: 密文
+        """
+        return self.outer.encode_password(inner_encoded_password)
+
+    def password_matches(self, raw_password, encoded_password):
+        return self.outer.password_matches(self.inner.encode_password(raw_password), encoded_password)
+
+    async def apassword_matches(self, raw_password, encoded_password):
+        return await self.outer.apassword_matches(self.inner.encode_password(raw_password), encoded_password)
+
+    def needs_rehash(self, encoded_password):
+        return self.outer.needs_rehash(encoded_password)
+
+
+# 内层编码器的密文长度 (十六进制摘要的字节数)
+_WRAPPING_INNER_DIGEST_BYTES = {
+    'md4': 32,
+    'md5': 32,
+    'sha1': 40,
+    'sha224': 56,
+    'sha256': 64,
+    'sha512': 128,
+}
+
+# 外层编码器能接受的最大密码长度 (字节)
+# bcrypt只使用前72个字节 (bcrypt 5.x 会直接抛出ValueError), 因此sha512的摘要不能用bcrypt包装
+_WRAPPING_OUTER_MAX_BYTES = {
+    'bcrypt': 72,
+}
+
+
+def _can_wrap(outer_name, inner_name):
+    max_bytes = _WRAPPING_OUTER_MAX_BYTES.get(outer_name)
+    digest_bytes = _WRAPPING_INNER_DIGEST_BYTES.get(inner_name)
+    return max_bytes is None or digest_bytes is None or digest_bytes <= max_bytes
+
+
+# 包装型编码器, 例如 'bcrypt_md5', 'scrypt_sha1'
+_INNER_ENCODERS.update(
+    {
+        '%s_%s' % (outer_name, inner_name): WrappingPasswordEncoder(_INNER_ENCODERS[outer_name],
+                                                                    _INNER_ENCODERS[inner_name])
+        for outer_name in ('bcrypt', 'scrypt', 'pbkdf2') if outer_name in _INNER_ENCODERS
+        for inner_name in _WRAPPING_INNER_DIGEST_BYTES
+        if _can_wrap(outer_name, inner_name)
+    }
+)
+
+
 class DelegatingPasswordEncoder(PasswordEncoder):
     encoding_algorithm = 'bcrypt' if _BCRYPT_PRESENT else 'md5'
 
+    # 额外的编码器, 字典 算法名称 -> PasswordEncoder实例, 可以覆盖内置的编码器
+    password_encoders = None
+
+    # 算法名称 -> 编码器 (只读), 在类创建时生成
+    _dispatch_table = MappingProxyType({})
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._build_dispatch_table()
+
+    @classmethod
+    def _build_dispatch_table(cls):
+        table = dict(_INNER_ENCODERS)
+        table.update(cls.password_encoders or {})
+        cls._dispatch_table = MappingProxyType(table)
+
     def __len__(self):
-        return len(_INNER_ENCODERS)
+        return len(self._dispatch_table)
 
     def __iter__(self):
-        return iter(_INNER_ENCODERS)
+        return iter(self._dispatch_table)
 
     def is_supported(self, alg_name):
-        return alg_name in _INNER_ENCODERS
+        return alg_name in self._dispatch_table
 
-    def encode_password(self, raw_password):
-        alg_id = self.encoding_algorithm
-        encoder = _INNER_ENCODERS.get(alg_id)
+    def _get_encoder(self, alg_id):
+        encoder = self._dispatch_table.get(alg_id)
         if encoder is None:
             raise ValueError("alg_id: '%s' not supported." % alg_id)
-        return '{%s}%s' % (alg_id, encoder.encode_password(raw_password))
+        return encoder
+
+    def encode_password(self, raw_password):
+        alg_id = self.encoding_algorithm
+        return '{%s}%s' % (alg_id, self._get_encoder(alg_id).encode_password(raw_password))
 
     def password_matches(self, raw_password, encoded_password):
         alg_id, real_encoded_pwd = self._get_alg_and_real_encoded_password(encoded_password)
-        encoder = _INNER_ENCODERS.get(alg_id)
-        if encoder is None:
-            raise ValueError("alg_id: '%s' not supported." % alg_id)
-        return encoder.password_matches(raw_password, real_encoded_pwd)
+        return self._get_encoder(alg_id).password_matches(raw_password, real_encoded_pwd)
+
+    async def apassword_matches(self, raw_password, encoded_password):
+        alg_id, real_encoded_pwd = self._get_alg_and_real_encoded_password(encoded_password)
+        return await self._get_encoder(alg_id).apassword_matches(raw_password, real_encoded_pwd)
+
+    def password_matches_many(self, pairs):
+        """
+        批量比较密码原文和密文是否匹配
+
+        按算法分组, 每个编码器在一个循环中连续处理同一组的密码。
+        在开始计算之前检查所有的算法, 有不支持的算法时直接抛出ValueError。
+
+        :param pairs: 可迭代对象, 元素为 (密码原文, 密码密文)
+        :return: 列表, 与输入顺序一致
+        """
+        groups = {}
+        for index, (raw_password, encoded_password) in enumerate(pairs):
+            alg_id, real_encoded_pwd = self._get_alg_and_real_encoded_password(encoded_password)
+            group = groups.get(alg_id)
+            if group is None:
+                group = groups[alg_id] = []
+            group.append((index, raw_password, real_encoded_pwd))
+
+        encoders = {alg_id: self._get_encoder(alg_id) for alg_id in groups}
+
+        ret = [False] * sum(len(x) for x in groups.values())
+        for alg_id, group in groups.items():
+            matches = encoders[alg_id].password_matches
+            for index, raw_password, real_encoded_pwd in group:
+                ret[index] = matches(raw_password, real_encoded_pwd)
+        return ret
+
+    def needs_rehash(self, encoded_password):
+        alg_id, real_encoded_pwd = self._get_alg_and_real_encoded_password(encoded_password)
+        if alg_id != self.encoding_algorithm:
+            return True
+        encoder = self._dispatch_table.get(alg_id)
+        return encoder is None or encoder.needs_rehash(real_encoded_pwd)
 
     @staticmethod
     def _get_alg_and_real_encoded_password(encoded_password):
-        alg = re.sub(r'^{([a-z0-9_]+)}.*$', r'\1', encoded_password)
+        # 只扫描开头的 '{alg_name}' 部分, 算法名称最长为_MAX_ALG_NAME_LENGTH个字符
+        if encoded_password[:1] == '{':
+            end = encoded_password.find('}', 1, _MAX_ALG_NAME_LENGTH + 2)
+            if end > 1:
+                alg = encoded_password[1:end]
+                if _ALG_NAME_REGEX.fullmatch(alg):
+                    return alg, encoded_password[end + 1:]
 
         # 不是 '{alg_name}xxx' 格式的密码，当noop处理
-        if alg == encoded_password:
-            return 'noop', encoded_password
-        return alg, re.sub(r'^{[a-z0-9_]+}(.*)$', r'\1', encoded_password)
+        return 'noop', encoded_password
+
+
+_MAX_ALG_NAME_LENGTH = 64
+
+_ALG_NAME_REGEX = re.compile(r'[a-z0-9_]+')
+
+DelegatingPasswordEncoder._build_dispatch_table()
+
+
+class CachingPasswordEncoder(PasswordEncoder):
+    """
+    带短期缓存的密码编码器
+
+    代理另一个PasswordEncoder, 将匹配成功的结果缓存ttl秒, 适用于每次请求都发送用户名和密码的
+    HTTP Basic认证等场景, 重复的请求只需一次HMAC计算与字典查询, 无需再执行bcrypt等慢哈希。
+
+    缓存键为 HMAC-SHA256(进程内随机密钥, 密码密文 + 密码原文), 不保存密码原文或可逆的编码。
+    修改密码后密文随之改变, 旧的缓存自然失效。只缓存匹配成功的结果, 错误的密码每次都会完整校验。
+    """
+
+    def __init__(self, delegate, *, ttl=60, max_size=4096):
+        """
+        构造方法
+
+        :param delegate: 被代理的PasswordEncoder实例
+        :param ttl: 缓存时间 (秒)
+        :param max_size: 最大缓存条目数
+        """
+        self._delegate = delegate
+        self._secret = os.urandom(32)
+        self._cache = lang.LRUCache(max_size, ttl=ttl)
+
+    @property
+    def delegate(self):
+        return self._delegate
+
+    def encode_password(self, raw_password):
+        return self._delegate.encode_password(raw_password)
+
+    def password_matches(self, raw_password, encoded_password):
+        key = self._cache_key(raw_password, encoded_password)
+        if self._cache.get(key, False):
+            return True
+
+        ret = self._delegate.password_matches(raw_password, encoded_password)
+        if ret:
+            self._cache.set(key, True)
+        return ret
+
+    async def apassword_matches(self, raw_password, encoded_password):
+        key = self._cache_key(raw_password, encoded_password)
+        if self._cache.get(key, False):
+            return True
+
+        ret = await self._delegate.apassword_matches(raw_password, encoded_password)
+        if ret:
+            self._cache.set(key, True)
+        return ret
+
+    def _cache_key(self, raw_password, encoded_password):
+        message = lang.ensure_bytes(encoded_password) + b'\x00' + lang.ensure_bytes(raw_password)
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
+
+    def clear(self):
+        """
+        清空缓存
+        """
+        self._cache.clear()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def calibrate_work_factors(target_seconds=0.25, *, apply=True):
+    """
+    测量当前机器的性能, 为bcrypt/scrypt/PBKDF2选择计算强度, 使一次校验的耗时尽量接近但不超过目标值
+
+    建议在进程启动时调用一次。调低计算强度不会使已有的密文失效, 但needs_rehash会以新的设置为准。
+
+    :param target_seconds: 一次校验的目标耗时 (秒)
+    :param apply: 是否将结果设置到各编码器的类属性上
+    :return: 字典 {'bcrypt_rounds': ..., 'scrypt_n': ..., 'pbkdf2_iterations': ...}, 未安装bcrypt时没有bcrypt_rounds
+    """
+    ret = {}
+    password = b'calibration-password'
+    salt = os.urandom(16)
+
+    def measure(fn, *args):
+        started = time.perf_counter()
+        fn(*args)
+        return time.perf_counter() - started
+
+    if _BCRYPT_PRESENT:
+        rounds = 4
+        hashed = bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+        elapsed = measure(bcrypt.checkpw, password, hashed)
+        # 每加1轮耗时翻倍, 按估算值前进, 不实际测量耗时过长的轮数
+        while rounds < 31 and elapsed * 2 <= target_seconds:
+            rounds += 1
+            elapsed *= 2
+        ret['bcrypt_rounds'] = rounds
+
+    log_n = 10
+    elapsed = measure(ScryptPasswordEncoder._derive, password, salt, {'ln': log_n, 'r': 8, 'p': 1}, 32)
+    while log_n < 20 and elapsed * 2 <= target_seconds:
+        elapsed = measure(ScryptPasswordEncoder._derive, password, salt, {'ln': log_n + 1, 'r': 8, 'p': 1}, 32)
+        if elapsed > target_seconds:
+            break
+        log_n += 1
+    ret['scrypt_n'] = 1 << log_n
+
+    elapsed = measure(Pbkdf2PasswordEncoder._derive, password, salt, {'i': 10000}, 32)
+    ret['pbkdf2_iterations'] = max(10000, int(10000 * target_seconds / elapsed) // 1000 * 1000)
+
+    if apply:
+        if 'bcrypt_rounds' in ret:
+            BcryptPasswordEncoder.rounds = ret['bcrypt_rounds']
+        ScryptPasswordEncoder.n = ret['scrypt_n']
+        ScryptPasswordEncoder.r = 8
+        ScryptPasswordEncoder.p = 1
+        Pbkdf2PasswordEncoder.iterations = ret['pbkdf2_iterations']
+    return ret
@@ -0,0 +1,185 @@
+r"""
+ ____  _                           ____
+|  _ \(_) __ _ _ __   __ _  ___   / ___| _   _  __ _  __ _ _ __
+| | | | |/ _` | '_ \ / _` |/ _ \  \___ \| | | |/ _` |/ _` | '__|
+| |_| | | (_| | | | | (_| | (_) |  ___) | |_| | (_| | (_| | |
+|____// |\__,_|_| |_|\__, |\___/  |____/ \__,_|\__, |\__,_|_|
+    |__/             |___/                     |___/
+
+    https://github.com/yingzhuo/django-sugar
+
+"""
+import keyword
+import threading
+from collections.abc import Mapping
+
+from django.db.models.manager import BaseManager
+from rest_framework import fields, serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+
+from django_sugar.valueobject import abstractfield
+
+# 可以内联的字段转换: Field.to_representation -> 表达式 (v为属性值)
+# 按函数判断, 子类没有重写to_representation时同样适用
+_INLINE_CONVERTERS = {
+    fields.CharField.to_representation: 'str(v)',
+    fields.IntegerField.to_representation: 'int(v)',
+    fields.FloatField.to_representation: 'float(v)',
+    fields.ReadOnlyField.to_representation: 'v',
+    abstractfield.AbstractField.to_representation: 'str(v)',
+}
+
+_SKIP = object()
+
+_compile_lock = threading.Lock()
+
+
+def get_compiled_representation(serializer_class):
+    """
+    获取序列化器类型编译后的to_representation函数
+
+    每个序列化器类型只编译一次, 结果缓存在类型上。
+    编译结果与serializer_class(many=True)中每个元素的序列化结果相同, 不支持上下文等额外参数。
+
+    :param serializer_class: 序列化器类型
+    :return: 函数, 参数为一个元素, 返回值为字典; 自定义了list_serializer_class时无法编译, 返回None
+    """
+    func = serializer_class.__dict__.get('_compiled_representation')
+    if func is None:
+        with _compile_lock:
+            func = serializer_class.__dict__.get('_compiled_representation')
+            if func is None:
+                list_serializer = serializer_class(many=True)
+                if type(list_serializer).to_representation is serializers.ListSerializer.to_representation:
+                    func = compile_serializer(list_serializer.child)
+                else:
+                    func = False
+                serializer_class._compiled_representation = func
+    return func or None
+
+
+def represent_many(serializer_class, data):
+    """
+    使用编译后的to_representation序列化多个元素
+
+    结果与serializer_class(instance=data, many=True).data相同。
+
+    :param serializer_class: 序列化器类型
+    :param data: 可迭代对象, QuerySet或Manager, None表示没有元素
+    :return: 列表
+    """
+    if data is None:
+        # 与ListSerializer(instance=None).data一致
+        return []
+
+    func = get_compiled_representation(serializer_class)
+    if func is None:
+        return serializer_class(instance=data, many=True).data
+    iterable = data.all() if isinstance(data, BaseManager) else data
+    return [func(x) for x in iterable]
+
+
+def compile_serializer(serializer):
+    """
+    将序列化器实例编译为一个函数
+
+    生成的源码直接访问属性, 并内联常用字段的转换, 省去DRF逐个字段的方法分派。
+    嵌套的序列化器递归编译; 其他字段 (例如关联字段, SerializerMethodField) 调用字段自己的方法。
+    序列化器重写了to_representation时直接使用其to_representation。
+
+    :param serializer: 序列化器实例 (已绑定字段)
+    :return: 函数, 参数为一个元素, 返回值为字典
+    """
+    if type(serializer).to_representation is not serializers.Serializer.to_representation or \
+            type(serializer)._readable_fields is not serializers.Serializer._readable_fields:
+        return serializer.to_representation
+
+    namespace = {
+        'Mapping': Mapping,
+        'PKOnlyObject': PKOnlyObject,
+        '_SKIP': _SKIP,
+        '_get_attribute': _get_attribute,
+        '_stock': serializer.to_representation,
+    }
+    lines = [
+        'def to_representation(instance):',
+        # 字典的属性访问总是失败, 直接使用DRF的实现
+        '    if isinstance(instance, Mapping):',
+        '        return _stock(instance)',
+        '    ret = {}',
+    ]
+
+    for i, field in enumerate(serializer._readable_fields):
+        namespace['_field_%d' % i] = field
+        name = repr(field.field_name)
+        converter = _get_converter(field, i, namespace)
+
+        attr = field.source_attrs[0] if len(field.source_attrs) == 1 else None
+        if type(field).get_attribute is fields.Field.get_attribute and _is_identifier(attr):
+            # 属性不存在或者是可调用的 (需要调用或者报错), 交给字段自己处理
+            lines += [
+                '    try:',
+                '        v = instance.%s' % attr,
+                '    except Exception:',
+                '        v = _get_attribute(_field_%d, instance)' % i,
+                '    else:',
+                '        if callable(v):',
+                '            v = _get_attribute(_field_%d, instance)' % i,
+                '    if v is not _SKIP:',
+                '        ret[%s] = None if v is None else %s' % (name, converter),
+            ]
+        else:
+            lines += [
+                '    v = _get_attribute(_field_%d, instance)' % i,
+                '    if v is not _SKIP:',
+                '        c = v.pk if isinstance(v, PKOnlyObject) else v',
+                '        ret[%s] = None if c is None else %s' % (name, converter),
+            ]
+
+    lines.append('    return ret')
+    source = '\n'.join(lines)
+    exec(compile(source, '<compiled %s>' % type(serializer).__name__, 'exec'), namespace)
+    func = namespace['to_representation']
+    func.__source__ = source
+    return func
+
+
+def _get_converter(field, i, namespace):
+    if isinstance(field, serializers.ListSerializer):
+        namespace['_convert_%d' % i] = _compile_list(field)
+        return '_convert_%d(v)' % i
+    if isinstance(field, serializers.BaseSerializer):
+        namespace['_convert_%d' % i] = compile_serializer(field)
+        return '_convert_%d(v)' % i
+
+    inline = _INLINE_CONVERTERS.get(type(field).to_representation)
+    if inline is not None:
+        return inline
+    namespace['_convert_%d' % i] = field.to_representation
+    return '_convert_%d(v)' % i
+
+
+def _compile_list(list_serializer):
+    if type(list_serializer).to_representation is not serializers.ListSerializer.to_representation:
+        return list_serializer.to_representation
+
+    child = compile_serializer(list_serializer.child)
+
+    def to_representation(data):
+        iterable = data.all() if isinstance(data, BaseManager) else data
+        return [child(x) for x in iterable]
+
+    return to_representation
+
+
+def _get_attribute(field, instance):
+    try:
+        return field.get_attribute(instance)
+    except SkipField:
+        return _SKIP
+
+
+def _is_identifier(name):
+    return name is not None and name.isidentifier() and not keyword.iskeyword(name) and not name.startswith('__')
+
@@ -11,6 +11,9 @@ r"""
 """
 import abc
 import string
+import threading
+
+from asgiref.sync import sync_to_async
 
 from django_sugar import lang
 
@@ -32,6 +35,17 @@ class TokenResolver(object, metaclass=abc.ABCMeta):
         :return: 令牌，一般是字符串类型
         """
 
+    async def aresolve_token(self, request, **kwargs):
+        """
+        从Http请求实例中获取令牌 (异步)
+
+        默认实现直接调用resolve_token, 解析请求头/请求参数不会阻塞事件循环。
+        :param request: 请求实例
+        :param kwargs: 其他可选参数
+        :return: 令牌，一般是字符串类型
+        """
+        return self.resolve_token(request, **kwargs)
+
 
 class QueryTokenResolver(TokenResolver):
     """
@@ -126,6 +140,12 @@ class CompositeTokenResolver(TokenResolver):
             return ret()
 
     def resolve_token(self, request, **kwargs):
+        if type(self).get_token_resolvers is not CompositeTokenResolver.get_token_resolvers:
+            # 子类自定义了解析器列表, 只能逐个尝试
+            return self._resolve_token_by_chain(request, **kwargs)
+        return self._get_compiled_resolver().resolve_token(request, **kwargs)
+
+    def _resolve_token_by_chain(self, request, **kwargs):
         for token_resolver in self.get_token_resolvers():
             # noinspection PyBroadException
             try:
@@ -136,10 +156,149 @@ class CompositeTokenResolver(TokenResolver):
                 continue
         return None
 
+    def _get_compiled_resolver(self):
+        # 每个类缓存一份, token_resolver_classes变化时重新编译
+        key = tuple(self.token_resolver_classes)
+        cls = type(self)
+        compiled = cls.__dict__.get('_compiled_token_resolver')
+        if compiled is None or compiled.key != key:
+            compiled = _CompiledTokenResolver(key)
+            cls._compiled_token_resolver = compiled
+        return compiled
+
     def get_token_resolvers(self):
         return [x() for x in self.token_resolver_classes]
 
 
+class _CompiledTokenResolver(object):
+    """
+    编译后的复合型令牌解析器
+
+    相邻且读取同一个请求头的HeaderTokenResolver合并为一步, 请求头只读取一次,
+    再按scheme (第一个空格之前的部分, 忽略大小写) 查表确定匹配的前缀。
+    QueryTokenResolver直接读取请求参数。
+    其他解析器仍然在每次请求时实例化并调用。
+
+    结果与按顺序逐个尝试完全一致。
+    """
+
+    def __init__(self, token_resolver_classes):
+        self.key = token_resolver_classes
+        self._stages = []
+
+        for resolver_class in token_resolver_classes:
+            header_name, prefix = _get_header_resolver_options(resolver_class)
+            if header_name is not None:
+                last = self._stages[-1] if self._stages else None
+                if not isinstance(last, _HeaderStage) or last.header_name.lower() != header_name.lower():
+                    last = _HeaderStage(header_name)
+                    self._stages.append(last)
+                last.add_prefix(prefix)
+                continue
+
+            parameter_name = _get_query_resolver_options(resolver_class)
+            if parameter_name is not None:
+                self._stages.append(_QueryStage(parameter_name))
+                continue
+
+            self._stages.append(_CustomStage(resolver_class))
+
+    def resolve_token(self, request, **kwargs):
+        for stage in self._stages:
+            # noinspection PyBroadException
+            try:
+                ret = stage(request, **kwargs)
+                if ret is not None:
+                    return ret
+            except Exception:
+                continue
+        return None
+
+
+def _is_plain_resolver_class(resolver_class, resolve_token_func):
+    return isinstance(resolver_class, type) \
+        and resolver_class.resolve_token is resolve_token_func \
+        and resolver_class.__init__ is object.__init__
+
+
+def _get_header_resolver_options(resolver_class):
+    if not _is_plain_resolver_class(resolver_class, HeaderTokenResolver.resolve_token):
+        return None, None
+    header_name = resolver_class.header_name
+    prefix = resolver_class.token_value_prefix
+    if not isinstance(header_name, str) or not isinstance(prefix, str):
+        return None, None
+    return header_name, prefix
+
+
+def _get_query_resolver_options(resolver_class):
+    if not _is_plain_resolver_class(resolver_class, QueryTokenResolver.resolve_token):
+        return None
+    parameter_name = resolver_class.token_parameter_name
+    return parameter_name if isinstance(parameter_name, str) else None
+
+
+class _HeaderStage(object):
+
+    def __init__(self, header_name):
+        self.header_name = header_name
+        # 小写的scheme -> (顺序, 前缀长度)
+        self._schemes = {}
+        # 不是"scheme + 空格"形式的前缀: [(顺序, 小写的前缀, 前缀长度), ...]
+        self._irregular_prefixes = []
+        self._count = 0
+
+    def add_prefix(self, prefix):
+        order = self._count
+        self._count += 1
+
+        scheme = prefix[:-1]
+        if prefix.endswith(' ') and scheme and scheme.isascii() and ' ' not in scheme:
+            # 同一个scheme出现多次时, 只有第一个有机会匹配
+            self._schemes.setdefault(scheme.lower(), (order, len(prefix)))
+        else:
+            self._irregular_prefixes.append((order, prefix.lower(), len(prefix)))
+
+    def __call__(self, request, **kwargs):
+        token_value = lang.blank_to_none(request.headers.get(self.header_name, None))
+        if token_value is None:
+            return None
+
+        matched = None
+        index = token_value.find(' ')
+        if index > 0:
+            matched = self._schemes.get(token_value[:index].lower())
+
+        if self._irregular_prefixes:
+            lowered = token_value.lower()
+            for order, prefix, length in self._irregular_prefixes:
+                if matched is not None and order > matched[0]:
+                    break
+                if lowered.startswith(prefix):
+                    matched = (order, length)
+                    break
+
+        return None if matched is None else token_value[matched[1]:]
+
+
+class _QueryStage(object):
+
+    def __init__(self, parameter_name):
+        self.parameter_name = parameter_name
+
+    def __call__(self, request, **kwargs):
+        return lang.blank_to_none(request.GET.get(self.parameter_name, None))
+
+
+class _CustomStage(object):
+
+    def __init__(self, resolver_class):
+        self.resolver_class = resolver_class
+
+    def __call__(self, request, **kwargs):
+        return self.resolver_class().resolve_token(request, **kwargs)
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 
 class TokenGenerator(object, metaclass=abc.ABCMeta):
@@ -157,6 +316,15 @@ class TokenGenerator(object, metaclass=abc.ABCMeta):
         :return: 令牌字符串
         """
 
+    def generate_tokens(self, users, **kwargs):
+        """
+        为多个用户批量生成令牌
+        :param users: 用户对象列表
+        :param kwargs: 其他参数
+        :return: 令牌字符串列表, 与输入顺序一致
+        """
+        return [self.generate_token(x, **kwargs) for x in users]
+
 
 class RandomUUIDTokenGenerator(TokenGenerator):
     """
@@ -195,6 +363,9 @@ class SimpleRandomStringTokenGenerator(TokenGenerator):
     def generate_token(self, user, **kwargs):
         return lang.random_string(self.length, chars=self.chars_to_choice)
 
+    def generate_tokens(self, users, **kwargs):
+        return lang.random_strings(len(list(users)), self.length, self.chars_to_choice)
+
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -206,6 +377,9 @@ class TokenBasedUserFinder(object, metaclass=abc.ABCMeta):
     此类为抽象类。
     """
 
+    # 认证流程指标接收器 (AuthMetricsSink实例) 默认不采集
+    auth_metrics_sink = None
+
     @abc.abstractmethod
     def get_user_by_token(self, current_token, **kwargs):
         """
@@ -214,3 +388,204 @@ class TokenBasedUserFinder(object, metaclass=abc.ABCMeta):
         :param kwargs: 其他参数
         :return: 用户信息
         """
+
+    async def aget_user_by_token(self, current_token, **kwargs):
+        """
+        从令牌中获取用户信息 (异步)
+
+        默认实现在线程中调用get_user_by_token, 子类可以覆盖本方法以使用异步的数据库/缓存访问。
+        :param current_token: 当前用于发送的令牌
+        :param kwargs: 其他参数
+        :return: 用户信息
+        """
+        return await sync_to_async(self.get_user_by_token)(current_token, **kwargs)
+
+
+class CachingTokenBasedUserFinderMixin(object):
+    """
+    带缓存的用户查找混入类
+
+    两级缓存: 进程内LRU + Django缓存。找不到用户的结果也会被缓存一小段时间。
+    必须放在TokenBasedUserFinder实现之前, 例如:
+
+    class MyAuthenticator(TokenBasedAuthenticator, JwtTokenParser,
+                          CachingTokenBasedUserFinderMixin, JwtTokenBasedUserFinder):
+        ...
+
+    只对提供了verify_token/get_user_by_claims的查找器 (例如JwtTokenBasedUserFinder) 生效,
+    并且查找器必须定义convert_user钩子方法 (异步版本为aconvert_user或convert_user):
+    每次仍会验证令牌, 然后以claims中的subject为键缓存convert_user转换得到的用户。
+    没有钩子方法时get_user_by_claims返回的是claims本身, 其中的scope/jti/exp等因令牌而异, 不缓存。
+    异步版本需要查找器提供averify_token/aget_user_by_claims。
+
+    注意: 缓存的用户只能由subject决定, convert_user不能依赖claims中的其他内容,
+    否则相同subject的其他令牌会得到第一个令牌转换出的用户。
+    其他查找器 (例如不透明令牌) 不缓存, 直接调用查找器: 令牌随时可能被删除或吊销,
+    以令牌为键的缓存无法通过invalidate_cached_user失效。
+
+    用户数据变化时应调用invalidate_cached_user。
+    进程内缓存按user_cache_key_prefix共享, 通过任意一个使用相同前缀的类都可以使其失效。
+    注意: 其他进程的进程内缓存最多在user_cache_local_ttl秒后才会失效。
+    """
+
+    # 进程内缓存的最大条目数
+    user_cache_local_max_size = 1024
+
+    # 进程内缓存的存活时间 (秒)
+    user_cache_local_ttl = 30
+
+    # Django缓存别名, None表示不使用Django缓存
+    user_cache_alias = 'default'
+
+    # Django缓存的存活时间 (秒)
+    user_cache_ttl = 300
+
+    # "用户不存在"结果的存活时间 (秒)
+    user_cache_negative_ttl = 10
+
+    # Django缓存键前缀
+    user_cache_key_prefix = 'django_sugar:user:'
+
+    # claims中作为subject的键
+    user_cache_subject_claim = 'sub'
+
+    def get_user_by_token(self, current_token, **kwargs):
+        verify_token = lang.get_callable_attr(self, 'verify_token', raise_error=False)
+        get_user_by_claims = lang.get_callable_attr(self, 'get_user_by_claims', raise_error=False)
+        convert_user = lang.get_callable_attr(self, 'convert_user', raise_error=False)
+
+        if verify_token and get_user_by_claims and convert_user:
+            claims = verify_token(current_token)
+            if not claims:
+                return None
+            subject = claims.get(self.user_cache_subject_claim)
+            if subject is None:
+                return get_user_by_claims(claims)
+            return self.get_cached_user(subject, lambda: get_user_by_claims(claims))
+
+        return super(CachingTokenBasedUserFinderMixin, self).get_user_by_token(current_token, **kwargs)
+
+    async def aget_user_by_token(self, current_token, **kwargs):
+        averify_token = lang.get_callable_attr(self, 'averify_token', raise_error=False)
+        aget_user_by_claims = lang.get_callable_attr(self, 'aget_user_by_claims', raise_error=False)
+        convert_user = lang.get_callable_attr(self, 'aconvert_user', raise_error=False) or \
+            lang.get_callable_attr(self, 'convert_user', raise_error=False)
+
+        if averify_token and aget_user_by_claims and convert_user:
+            claims = await averify_token(current_token)
+            if not claims:
+                return None
+            subject = claims.get(self.user_cache_subject_claim)
+            if subject is None:
+                return await aget_user_by_claims(claims)
+            return await self.aget_cached_user(subject, lambda: aget_user_by_claims(claims))
+
+        return await super(CachingTokenBasedUserFinderMixin, self).aget_user_by_token(current_token, **kwargs)
+
+    def get_cached_user(self, subject, loader):
+        """
+        从缓存中获取用户, 缓存未命中时调用loader并缓存其结果
+
+        :param subject: 用户标识
+        :param loader: 无参函数, 返回用户或None
+        :return: 用户或None
+        """
+        key = self.user_cache_key_prefix + str(subject)
+        local_cache = self._get_local_user_cache()
+
+        user = local_cache.get(key, _NO_CACHED_USER)
+        if user is not _NO_CACHED_USER:
+            return None if user == _NO_SUCH_USER else user
+
+        django_cache = self._get_django_user_cache()
+        if django_cache is not None:
+            user = django_cache.get(key, _NO_CACHED_USER)
+            if user is not _NO_CACHED_USER:
+                self._put_local_user(local_cache, key, user)
+                return None if user == _NO_SUCH_USER else user
+
+        user = loader()
+        value = _NO_SUCH_USER if user is None else user
+        self._put_local_user(local_cache, key, value)
+        if django_cache is not None:
+            timeout = self.user_cache_negative_ttl if user is None else self.user_cache_ttl
+            django_cache.set(key, value, timeout=timeout)
+        return user
+
+    async def aget_cached_user(self, subject, aloader):
+        """
+        从缓存中获取用户 (异步), 缓存未命中时调用aloader并缓存其结果
+
+        :param subject: 用户标识
+        :param aloader: 无参函数, 返回awaitable, 其结果为用户或None
+        :return: 用户或None
+        """
+        key = self.user_cache_key_prefix + str(subject)
+        local_cache = self._get_local_user_cache()
+
+        user = local_cache.get(key, _NO_CACHED_USER)
+        if user is not _NO_CACHED_USER:
+            return None if user == _NO_SUCH_USER else user
+
+        django_cache = self._get_django_user_cache()
+        if django_cache is not None:
+            user = await django_cache.aget(key, _NO_CACHED_USER)
+            if user is not _NO_CACHED_USER:
+                self._put_local_user(local_cache, key, user)
+                return None if user == _NO_SUCH_USER else user
+
+        user = await aloader()
+        value = _NO_SUCH_USER if user is None else user
+        self._put_local_user(local_cache, key, value)
+        if django_cache is not None:
+            timeout = self.user_cache_negative_ttl if user is None else self.user_cache_ttl
+            await django_cache.aset(key, value, timeout=timeout)
+        return user
+
+    def _put_local_user(self, local_cache, key, value):
+        if value == _NO_SUCH_USER:
+            local_cache.set(key, value, ttl=min(self.user_cache_negative_ttl, self.user_cache_local_ttl))
+        else:
+            local_cache.set(key, value)
+
+    @classmethod
+    def invalidate_cached_user(cls, subject):
+        """
+        使缓存的用户失效
+
+        :param subject: 用户标识 (与缓存时使用的subject相同)
+        """
+        key = cls.user_cache_key_prefix + str(subject)
+        cls._get_local_user_cache().delete(key)
+        django_cache = cls._get_django_user_cache()
+        if django_cache is not None:
+            django_cache.delete(key)
+
+    @classmethod
+    def _get_local_user_cache(cls):
+        # 按键前缀注册, 子类与父类共用一份, 失效时不会漏掉某个类的缓存
+        prefix = cls.user_cache_key_prefix
+        local_cache = _LOCAL_USER_CACHES.get(prefix)
+        if local_cache is None:
+            with _LOCAL_USER_CACHES_LOCK:
+                local_cache = _LOCAL_USER_CACHES.get(prefix)
+                if local_cache is None:
+                    local_cache = lang.LRUCache(cls.user_cache_local_max_size, ttl=cls.user_cache_local_ttl)
+                    _LOCAL_USER_CACHES[prefix] = local_cache
+        return local_cache
+
+    @classmethod
+    def _get_django_user_cache(cls):
+        if cls.user_cache_alias is None:
+            return None
+        from django.core.cache import caches
+        return caches[cls.user_cache_alias]
+
+
+_NO_CACHED_USER = object()
+
+_LOCAL_USER_CACHES = {}
+_LOCAL_USER_CACHES_LOCK = threading.Lock()
+
+# 缓存中表示"用户不存在"的值, 需要能被Django缓存序列化
+_NO_SUCH_USER = '__django_sugar_no_such_user__'
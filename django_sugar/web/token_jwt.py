@@ -10,13 +10,25 @@ r"""
 
 """
 import abc
+import asyncio
+import base64
+import calendar
+import datetime
+import functools
+import hashlib
+import json
+import math
+import threading
+import time
+from concurrent import futures
 from typing import Optional, Dict, Any
 
 import jwt
-from jwt import exceptions
+from asgiref.sync import sync_to_async
+from jwt import exceptions, algorithms
 
 from django_sugar import lang
-from django_sugar.web import token, jwt_base
+from django_sugar.web import token, jwt_base, jwt_keyring
 
 
 class JwtTokenParser(token.BearerTokenResolver):
@@ -98,13 +110,118 @@ class MissingRequiredClaimException(JWTException):
     pass
 
 
+class RevokedTokenException(JWTException):
+    """
+    令牌已被吊销
+    """
+    pass
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class JwtVerifiedTokenCache(object):
+    """
+    已验证JWT令牌缓存
+
+    缓存验签通过的令牌的claims, 键为令牌的摘要而非令牌本身。
+    条目最迟在令牌的exp时刻过期, nbf尚未到达的令牌不会被缓存。
+    条目同时记录验签的范围 (签名组件, 密钥环的版本与验证选项), 范围不同时视为未命中,
+    因此密钥环中的密钥被移除后, 用它签名的令牌不会继续通过验证;
+    共用同一个缓存对象但密钥或验证选项不同的查找器之间也不会互相命中。
+    """
+
+    def __init__(self, max_size=4096, *, ttl=300):
+        """
+        构造方法
+
+        :param max_size: 最大条目数
+        :param ttl: 条目最长存活时间 (秒)
+        """
+        self._cache = lang.LRUCache(max_size, ttl=ttl)
+
+    def __len__(self):
+        return len(self._cache)
+
+    @staticmethod
+    def _digest(jwt_token):
+        return hashlib.sha256(lang.ensure_bytes(jwt_token)).digest()
+
+    def get(self, jwt_token, *, scope=None):
+        """
+        获取已缓存的claims
+
+        :param jwt_token: 令牌
+        :param scope: 当前的验签范围, 与缓存时的范围不同时视为未命中
+        :return: claims, 未命中时返回None
+        """
+        entry = self._cache.get(self._digest(jwt_token))
+        if entry is None or entry[0] != scope:
+            return None
+        return entry[1]
+
+    def put(self, jwt_token, claims, *, scope=None):
+        """
+        缓存验签通过的claims
+
+        :param jwt_token: 令牌
+        :param claims: 验签通过的claims
+        :param scope: 验签时的范围
+        """
+        if not isinstance(claims, dict):
+            return
+
+        now = time.time()
+
+        nbf = claims.get('nbf')
+        if nbf is not None:
+            if not isinstance(nbf, (int, float)) or nbf > now:
+                return
+
+        expires_at = None
+        exp = claims.get('exp')
+        if exp is not None:
+            if not isinstance(exp, (int, float)) or exp <= now:
+                return
+            # exp是墙上时间, 换算成缓存使用的单调时钟
+            expires_at = time.monotonic() + (exp - now)
+
+        self._cache.set(self._digest(jwt_token), (scope, claims), expires_at=expires_at)
+
+    def clear(self):
+        self._cache.clear()
+
+    @property
+    def hits(self):
+        return self._cache.hits
+
+    @property
+    def misses(self):
+        return self._cache.misses
+
+    @property
+    def evictions(self):
+        return self._cache.evictions
+
+    @property
+    def stats(self):
+        return self._cache.stats
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 
 
 class JwtTokenBasedUserFinder(token.TokenBasedUserFinder):
-    # 签名算法与密钥
+    # 签名算法与密钥, 也可以是JsonWebTokenKeyRing
     jwt_sign_component = jwt_base.JsonWebTokenSignatureComponent.hs384('DjangoSugar!')
 
+    # 已验证令牌缓存 (JwtVerifiedTokenCache实例) 默认不启用
+    # 提示: 缓存对象在类上共享, 子类也会继承; 条目按签名组件与验证选项区分, 不会被其他查找器命中
+    jwt_verified_token_cache = None
+
+    # 令牌吊销列表 (JtiRevocationList实例) 默认不启用
+    jwt_revocation_list = None
+
     # 是否要验证JWT的签名
     jwt_verify_signature = True
 
@@ -126,9 +243,47 @@ class JwtTokenBasedUserFinder(token.TokenBasedUserFinder):
     # 比需要有的 claims_name 默认无要求
     jwt_required_claims_names = []
 
+    # verify_many与异步验签时, 验证非对称算法签名所使用的线程数
+    jwt_verify_max_workers = 4
+
     def get_user_by_token(self, jwt_token, **kwargs):
-        user_info = self._parse_token(jwt_token)
+        sink = self.auth_metrics_sink
+        if sink is None:
+            return self.get_user_by_claims(self._parse_token(jwt_token))
+
+        started = time.perf_counter_ns()
+        try:
+            user_info = self._parse_token(jwt_token)
+        except Exception as exc:
+            sink.record_failure('verify_token', exc)
+            raise
+        verified = time.perf_counter_ns()
+        sink.record_timing('verify_token', verified - started)
+
+        try:
+            return self.get_user_by_claims(user_info)
+        except Exception as exc:
+            sink.record_failure('convert_user', exc)
+            raise
+        finally:
+            sink.record_timing('convert_user', time.perf_counter_ns() - verified)
+
+    def verify_token(self, jwt_token):
+        """
+        验证令牌
+
+        :param jwt_token: 令牌
+        :return: claims, 验证失败时抛出JWTException (map_exception返回None时返回None)
+        """
+        return self._parse_token(jwt_token)
+
+    def get_user_by_claims(self, user_info):
+        """
+        从验证过的claims中获取用户信息
 
+        :param user_info: claims
+        :return: 用户信息, 有convert_user钩子方法时为其转换的结果
+        """
         if not user_info:
             return None
 
@@ -139,7 +294,181 @@ class JwtTokenBasedUserFinder(token.TokenBasedUserFinder):
         else:
             return user_info
 
-    def _parse_token(self, jwt_token) -> Optional[dict]:
+    async def aget_user_by_token(self, jwt_token, **kwargs):
+        sink = self.auth_metrics_sink
+        if sink is None:
+            return await self.aget_user_by_claims(await self._aparse_token(jwt_token))
+
+        started = time.perf_counter_ns()
+        try:
+            user_info = await self._aparse_token(jwt_token)
+        except Exception as exc:
+            sink.record_failure('verify_token', exc)
+            raise
+        verified = time.perf_counter_ns()
+        sink.record_timing('verify_token', verified - started)
+
+        try:
+            return await self.aget_user_by_claims(user_info)
+        except Exception as exc:
+            sink.record_failure('convert_user', exc)
+            raise
+        finally:
+            sink.record_timing('convert_user', time.perf_counter_ns() - verified)
+
+    async def averify_token(self, jwt_token):
+        """
+        验证令牌 (异步)
+
+        :param jwt_token: 令牌
+        :return: claims, 验证失败时抛出JWTException (map_exception返回None时返回None)
+        """
+        return await self._aparse_token(jwt_token)
+
+    async def aget_user_by_claims(self, user_info):
+        """
+        从验证过的claims中获取用户信息 (异步)
+
+        :param user_info: claims
+        :return: 用户信息, 有aconvert_user/convert_user钩子方法时为其转换的结果
+        """
+        if not user_info:
+            return None
+
+        # 尝试调用钩子方法转换类型, 优先使用异步版本
+        aconvert_user = lang.get_callable_attr(self, 'aconvert_user', raise_error=False)
+        if aconvert_user:
+            return await aconvert_user(user_info)
+
+        convert_user = lang.get_callable_attr(self, 'convert_user', raise_error=False)
+        if convert_user:
+            return await sync_to_async(convert_user)(user_info)
+        else:
+            return user_info
+
+    async def _aparse_token(self, jwt_token) -> Optional[dict]:
+        cache = self.jwt_verified_token_cache
+        scope = self._get_cache_scope()
+        if cache is not None:
+            claims = cache.get(jwt_token, scope=scope)
+            if claims is not None:
+                return self._check_revocation(dict(claims))
+
+        try:
+            sign_component = self._get_sign_component(jwt_token)
+        except exceptions.PyJWTError as exc:
+            exc = self.map_exception(exc)
+            if exc is None:
+                return None
+            else:
+                raise exc
+
+        if _is_asymmetric(sign_component):
+            # 非对称算法验签较慢, 交给有界线程池执行, 不阻塞事件循环
+            loop = asyncio.get_running_loop()
+            executor = _get_signature_executor(self.jwt_verify_max_workers)
+            claims = await loop.run_in_executor(executor, self._decode_token, jwt_token, sign_component)
+        else:
+            claims = self._decode_token(jwt_token, sign_component)
+
+        if cache is not None and claims is not None:
+            cache.put(jwt_token, dict(claims), scope=scope)
+        return self._check_revocation(claims)
+
+    def verify_many(self, jwt_tokens, *, max_workers=None):
+        """
+        批量验证令牌
+
+        相同的令牌只验证一次, 令牌按签名组件(算法/kid)分组,
+        非对称算法的验签在线程池中并行执行 (cryptography验签时会释放GIL)。
+
+        :param jwt_tokens: 令牌列表
+        :param max_workers: 线程数, 默认为jwt_verify_max_workers
+        :return: 与输入顺序一致的列表, 元素为claims或JWTException实例 (map_exception返回None时为None)
+        """
+        jwt_tokens = list(jwt_tokens)
+        results = {}
+        groups = {}
+
+        for jwt_token in dict.fromkeys(jwt_tokens):
+            try:
+                sign_component = self._get_sign_component(jwt_token)
+            except exceptions.PyJWTError as exc:
+                results[jwt_token] = self.map_exception(exc)
+                continue
+            groups.setdefault(sign_component, []).append(jwt_token)
+
+        max_workers = max_workers or self.jwt_verify_max_workers
+        pending = []
+        for sign_component, group in groups.items():
+            if max_workers <= 1 or len(group) == 1 or not _is_asymmetric(sign_component):
+                # HMAC验签很快, 放到线程池中反而更慢
+                results.update(self._verify_chunk(group, sign_component))
+                continue
+
+            executor = _get_signature_executor(max_workers)
+            chunk_size = math.ceil(len(group) / max_workers)
+            for i in range(0, len(group), chunk_size):
+                pending.append(executor.submit(self._verify_chunk, group[i:i + chunk_size], sign_component))
+
+        for future in pending:
+            results.update(future.result())
+
+        return [results[x] for x in jwt_tokens]
+
+    def _verify_chunk(self, jwt_tokens, sign_component):
+        ret = []
+        for jwt_token in jwt_tokens:
+            try:
+                ret.append((jwt_token, self._parse_token(jwt_token, sign_component)))
+            except JWTException as exc:
+                ret.append((jwt_token, exc))
+        return ret
+
+    def _parse_token(self, jwt_token, sign_component=None) -> Optional[dict]:
+        cache = self.jwt_verified_token_cache
+        scope = self._get_cache_scope()
+        if cache is not None:
+            claims = cache.get(jwt_token, scope=scope)
+            if claims is not None:
+                # 返回副本, 以免convert_user修改缓存中的数据
+                return self._check_revocation(dict(claims))
+
+        claims = self._decode_token(jwt_token, sign_component)
+
+        if cache is not None and claims is not None:
+            cache.put(jwt_token, dict(claims), scope=scope)
+        return self._check_revocation(claims)
+
+    def _get_cache_scope(self):
+        # 读取版本在验签之前, 验签期间密钥发生变化时缓存的条目不会被后续的请求命中
+        sign_component = self.jwt_sign_component
+        key_version = None
+        if isinstance(sign_component, jwt_keyring.JsonWebTokenKeyRing):
+            key_version = sign_component.version
+
+        # 签名组件按对象身份比较, 子类替换了密钥或验证选项时不会命中父类缓存的条目
+        return (
+            sign_component,
+            key_version,
+            self.jwt_verify_signature,
+            self.jwt_verify_exp,
+            self.jwt_verify_nbf,
+            self.jwt_verify_iat,
+            self.jwt_verify_iss,
+            self.jwt_verify_aud,
+            tuple(self.jwt_required_claims_names or ()),
+        )
+
+    def _check_revocation(self, claims):
+        revocation_list = self.jwt_revocation_list
+        if revocation_list is not None and claims:
+            jti = claims.get('jti')
+            if jti is not None and revocation_list.is_revoked(jti):
+                raise RevokedTokenException('Token has been revoked.')
+        return claims
+
+    def _decode_token(self, jwt_token, sign_component=None) -> Optional[dict]:
         try:
             options = {
                 'verify_signature': self.jwt_verify_signature,
@@ -153,9 +482,10 @@ class JwtTokenBasedUserFinder(token.TokenBasedUserFinder):
             if self.jwt_required_claims_names:
                 options['require'] = self.jwt_required_claims_names
 
+            sign_component = sign_component or self._get_sign_component(jwt_token)
             return jwt.decode(jwt_token,
-                              key=self.jwt_sign_component.decoding_key,
-                              algorithms=[self.jwt_sign_component.name],
+                              key=sign_component.decoding_key,
+                              algorithms=[sign_component.name],
                               options=options)
         except exceptions.PyJWTError as exc:
             exc = self.map_exception(exc)
@@ -164,6 +494,12 @@ class JwtTokenBasedUserFinder(token.TokenBasedUserFinder):
             else:
                 raise exc
 
+    def _get_sign_component(self, jwt_token):
+        sign_component = self.jwt_sign_component
+        if isinstance(sign_component, jwt_keyring.JsonWebTokenKeyRing):
+            return sign_component.select(jwt_token)
+        return sign_component
+
     def map_exception(self, ex):
 
         if isinstance(ex, exceptions.ExpiredSignatureError):
@@ -196,6 +532,26 @@ class JwtTokenBasedUserFinder(token.TokenBasedUserFinder):
         return None
 
 
+_SIGNATURE_EXECUTORS = {}
+_SIGNATURE_EXECUTORS_LOCK = threading.Lock()
+
+
+def _get_signature_executor(max_workers):
+    executor = _SIGNATURE_EXECUTORS.get(max_workers)
+    if executor is None:
+        with _SIGNATURE_EXECUTORS_LOCK:
+            executor = _SIGNATURE_EXECUTORS.get(max_workers)
+            if executor is None:
+                executor = futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='jwt-signature')
+                _SIGNATURE_EXECUTORS[max_workers] = executor
+    return executor
+
+
+def _is_asymmetric(sign_component):
+    name = sign_component.name
+    return name != 'none' and not name.startswith('HS')
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 
 
@@ -206,15 +562,44 @@ class JwtTokenGenerator(token.TokenGenerator, metaclass=abc.ABCMeta):
     此类为抽象类。
     """
 
-    # 加密key
+    # 加密key, 也可以是JsonWebTokenKeyRing (使用其signing_kid对应的密钥)
     jwt_sign_component = jwt_base.JsonWebTokenSignatureComponent.hs384('DjangoSugar!')
 
+    # 写入令牌头部的kid, 默认不写入
+    jwt_key_id = None
+
+    # generate_tokens对非对称算法签名时使用的线程数, 默认不使用线程池
+    jwt_sign_max_workers = 1
+
     def generate_token(self, user, **kwargs):
         jwt_payload = self.user_to_jwt_payload(user)
-        return jwt.encode(jwt_payload,
-                          self.jwt_sign_component.encoding_key,
-                          algorithm=self.jwt_sign_component.name
-                          )
+        return self._get_minter().mint(jwt_payload)
+
+    def generate_tokens(self, users, *, max_workers=None, **kwargs):
+        """
+        为多个用户批量生成令牌
+
+        :param users: 用户对象列表
+        :param max_workers: 非对称算法签名时使用的线程数, 默认为jwt_sign_max_workers
+        :param kwargs: 其他参数
+        :return: 令牌列表, 与输入顺序一致
+        """
+        jwt_payloads = [self.user_to_jwt_payload(x) for x in users]
+        return self._get_minter().mint_many(jwt_payloads, max_workers=max_workers or self.jwt_sign_max_workers)
+
+    def _get_minter(self):
+        sign_component, kid = self._get_sign_component_and_kid()
+        return _get_minter(sign_component, kid)
+
+    def _get_sign_component_and_kid(self):
+        sign_component = self.jwt_sign_component
+        if isinstance(sign_component, jwt_keyring.JsonWebTokenKeyRing):
+            kid = sign_component.signing_kid
+            sign_component = sign_component.signing_component
+            if sign_component is None:
+                raise ValueError("Signing kid '%s' not found in key ring." % kid)
+            return sign_component, kid
+        return sign_component, self.jwt_key_id
 
     @abc.abstractmethod
     def user_to_jwt_payload(self, user) -> Optional[Dict[str, Any]]:
@@ -232,3 +617,82 @@ class JwtTokenGenerator(token.TokenGenerator, metaclass=abc.ABCMeta):
         :param user: 用户对象
         :return: 字典
         """
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class JwtTokenMinter(object):
+    """
+    JWT令牌快速生成工具
+
+    头部段落(base64url编码后)在构造时计算一次, 算法与密钥也只准备一次,
+    生成令牌时只需序列化payload并签名。生成的令牌与jwt.encode的结果相同。
+    """
+
+    def __init__(self, sign_component, *, headers=None):
+        """
+        构造方法
+
+        :param sign_component: JsonWebTokenSignatureComponent实例
+        :param headers: 额外的头部信息, 例如kid
+        """
+        name = sign_component.name
+        algorithm = algorithms.get_default_algorithms()[name]
+
+        header = {'typ': 'JWT', 'alg': name, **(headers or {})}
+        header = json.dumps(header, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+        self._name = name
+        self._header_segment = _base64url_encode(header) + b'.'
+        self._key = algorithm.prepare_key(sign_component.encoding_key)
+        self._sign = algorithm.sign
+
+    def mint(self, jwt_payload):
+        """
+        生成令牌
+
+        :param jwt_payload: payload (字典)
+        :return: 令牌
+        """
+        if not isinstance(jwt_payload, dict):
+            raise TypeError('Expecting a dict object, as JWT only supports JSON objects as payloads.')
+
+        for time_claim in ('exp', 'iat', 'nbf'):
+            value = jwt_payload.get(time_claim)
+            if isinstance(value, datetime.datetime):
+                jwt_payload = {**jwt_payload, time_claim: calendar.timegm(value.utctimetuple())}
+
+        payload = json.dumps(jwt_payload, separators=(',', ':')).encode('utf-8')
+        signing_input = self._header_segment + _base64url_encode(payload)
+        signature = self._sign(signing_input, self._key)
+        return (signing_input + b'.' + _base64url_encode(signature)).decode('utf-8')
+
+    def mint_many(self, jwt_payloads, *, max_workers=1):
+        """
+        批量生成令牌
+
+        :param jwt_payloads: payload列表
+        :param max_workers: 非对称算法签名时使用的线程数
+        :return: 令牌列表, 与输入顺序一致
+        """
+        jwt_payloads = list(jwt_payloads)
+        if max_workers <= 1 or len(jwt_payloads) <= 1 or self._name == 'none' or self._name.startswith('HS'):
+            return [self.mint(x) for x in jwt_payloads]
+
+        executor = _get_signature_executor(max_workers)
+        chunk_size = math.ceil(len(jwt_payloads) / max_workers)
+        chunks = [jwt_payloads[i:i + chunk_size] for i in range(0, len(jwt_payloads), chunk_size)]
+        ret = []
+        for tokens in executor.map(lambda chunk: [self.mint(x) for x in chunk], chunks):
+            ret.extend(tokens)
+        return ret
+
+
+def _base64url_encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+@functools.lru_cache(maxsize=64)
+def _get_minter(sign_component, kid):
+    return JwtTokenMinter(sign_component, headers={'kid': kid} if kid is not None else None)
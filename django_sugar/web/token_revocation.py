@@ -0,0 +1,321 @@
+r"""
+ ____  _                           ____
+|  _ \(_) __ _ _ __   __ _  ___   / ___| _   _  __ _  __ _ _ __
+| | | | |/ _` | '_ \ / _` |/ _ \  \___ \| | | |/ _` |/ _` | '__|
+| |_| | | (_| | | | | (_| | (_) |  ___) | |_| | (_| | (_| | |
+|____// |\__,_|_| |_|\__, |\___/  |____/ \__,_|\__, |\__,_|_|
+    |__/             |___/                     |___/
+
+    https://github.com/yingzhuo/django-sugar
+
+"""
+import abc
+import logging
+import sqlite3
+import threading
+import time
+
+from django_sugar import lang
+
+
+class RevocationStore(object, metaclass=abc.ABCMeta):
+    """
+    令牌吊销记录的权威存储
+
+    本类为抽象类。
+    每条记录为 (jti, exp), exp为UNIX时间戳, 到期后记录自动失效。
+    """
+
+    @abc.abstractmethod
+    def add(self, jti, exp=None):
+        """
+        添加吊销记录
+
+        :param jti: 令牌ID
+        :param exp: 令牌的过期时间 (UNIX时间戳), None表示永不过期
+        """
+
+    @abc.abstractmethod
+    def contains(self, jti):
+        """
+        判断令牌是否已被吊销
+
+        :param jti: 令牌ID
+        :return: 结果
+        """
+
+    @abc.abstractmethod
+    def entries_since(self, cursor):
+        """
+        获取游标之后新增的吊销记录
+
+        :param cursor: 游标, 0表示从头开始
+        :return: 二元组 (记录列表[(jti, exp), ...], 新的游标)
+        """
+
+    def purge_expired(self):
+        """
+        清理已过期的记录
+        """
+
+
+class SQLiteRevocationStore(RevocationStore):
+    """
+    基于本地SQLite文件的吊销记录存储
+
+    同一台机器上的多个进程可以共享同一个文件。
+    """
+
+    def __init__(self, path, *, table_name='jwt_revoked_jti'):
+        """
+        构造方法
+
+        :param path: SQLite文件路径
+        :param table_name: 表名
+        """
+        self._path = path
+        self._table_name = table_name
+        self._local = threading.local()
+        with self._get_connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS %s ('
+                         'seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'jti TEXT NOT NULL UNIQUE, '
+                         'exp REAL)' % table_name)
+
+    def _get_connection(self):
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=30)
+            self._local.connection = conn
+        return conn
+
+    def add(self, jti, exp=None):
+        with self._get_connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO %s (jti, exp) VALUES (?, ?)' % self._table_name, (jti, exp))
+
+    def contains(self, jti):
+        sql = 'SELECT 1 FROM %s WHERE jti = ? AND (exp IS NULL OR exp > ?)' % self._table_name
+        return self._get_connection().execute(sql, (jti, time.time())).fetchone() is not None
+
+    def entries_since(self, cursor):
+        sql = 'SELECT seq, jti, exp FROM %s WHERE seq > ? ORDER BY seq' % self._table_name
+        rows = self._get_connection().execute(sql, (cursor,)).fetchall()
+        if not rows:
+            return [], cursor
+        return [(jti, exp) for _, jti, exp in rows], rows[-1][0]
+
+    def purge_expired(self):
+        with self._get_connection() as conn:
+            conn.execute('DELETE FROM %s WHERE exp IS NOT NULL AND exp <= ?' % self._table_name, (time.time(),))
+
+
+class DjangoCacheRevocationStore(RevocationStore):
+    """
+    基于Django缓存的吊销记录存储
+
+    每条记录以jti为键保存一份, 同时以递增序号为键保存一份, 以便其他进程增量同步。
+    缓存的过期时间即为令牌的过期时间。
+    """
+
+    def __init__(self, *, cache_alias='default', key_prefix='django_sugar:revoked_jti:'):
+        """
+        构造方法
+
+        :param cache_alias: Django缓存别名
+        :param key_prefix: 缓存键前缀
+        """
+        self._cache_alias = cache_alias
+        self._key_prefix = key_prefix
+
+    @property
+    def _cache(self):
+        from django.core.cache import caches
+        return caches[self._cache_alias]
+
+    def _timeout(self, exp):
+        if exp is None:
+            return None
+        return max(1, int(exp - time.time()) + 1)
+
+    def add(self, jti, exp=None):
+        cache = self._cache
+        timeout = self._timeout(exp)
+        seq_key = self._key_prefix + 'seq'
+        cache.add(seq_key, 0, timeout=None)
+        try:
+            seq = cache.incr(seq_key)
+        except ValueError:
+            # 序号被淘汰了, 重新开始计数
+            cache.add(seq_key, 0, timeout=None)
+            seq = cache.incr(seq_key)
+        cache.set_many({
+            self._key_prefix + 'jti:' + jti: exp or 0,
+            self._key_prefix + 'seq:%d' % seq: (jti, exp),
+        }, timeout=timeout)
+
+    def contains(self, jti):
+        return self._cache.get(self._key_prefix + 'jti:' + jti) is not None
+
+    def entries_since(self, cursor):
+        cache = self._cache
+        current = cache.get(self._key_prefix + 'seq', 0)
+        if current < cursor:
+            # 序号被重置了, 从头开始同步
+            cursor = 0
+
+        ret = []
+        for start in range(cursor + 1, current + 1, 1000):
+            keys = [self._key_prefix + 'seq:%d' % x for x in range(start, min(start + 1000, current + 1))]
+            ret.extend(cache.get_many(keys).values())
+        return ret, current
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class JtiRevocationList(object):
+    """
+    令牌吊销列表
+
+    进程内的布隆过滤器作为前端, 绝大多数未被吊销的令牌只需查询过滤器即可确定;
+    只有过滤器命中时才查询权威存储。
+
+    过滤器每隔sync_interval秒从存储增量同步一次, 其他进程吊销的令牌最多延迟sync_interval秒生效;
+    本进程吊销的令牌立即生效。过滤器每隔rebuild_interval秒重建一次, 以移除已过期的记录。
+    同步与重建默认在后台线程中进行, 请求线程不访问存储 (过滤器命中时除外)。
+
+    向过滤器添加记录与替换过滤器使用同一把锁, 重建期间吊销的令牌不会丢失。
+    """
+
+    def __init__(self, store, *, capacity=100000, error_rate=0.001, sync_interval=1.0, rebuild_interval=3600,
+                 background=True):
+        """
+        构造方法
+
+        :param store: RevocationStore实例
+        :param capacity: 布隆过滤器的预计容量
+        :param error_rate: 布隆过滤器的误判率
+        :param sync_interval: 增量同步的间隔 (秒)
+        :param rebuild_interval: 重建过滤器的间隔 (秒)
+        :param background: 是否在后台线程中同步; 为False时在调用is_revoked时同步 (同一时刻只有一个线程进行)
+        """
+        self._store = store
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._sync_interval = sync_interval
+        self._rebuild_interval = rebuild_interval
+        self._sync_lock = threading.Lock()
+        self._filter_lock = threading.Lock()
+        self._cursor = 0
+        self._filter = lang.BloomFilter(capacity, error_rate)
+        self._next_sync = 0
+        self._next_rebuild = 0
+        self._sync(force=True)
+
+        self._refresher = None
+        if background:
+            self._refresher = _RevocationListRefresher(self, sync_interval)
+            self._refresher.start()
+
+    @property
+    def store(self):
+        return self._store
+
+    def revoke(self, jti, exp=None):
+        """
+        吊销令牌
+
+        :param jti: 令牌ID
+        :param exp: 令牌的过期时间 (UNIX时间戳)
+        """
+        self._store.add(jti, exp)
+        with self._filter_lock:
+            self._filter.add(jti)
+
+    def revoke_claims(self, claims):
+        """
+        吊销令牌
+
+        :param claims: 令牌的claims, 必须包含jti
+        """
+        self.revoke(claims['jti'], claims.get('exp'))
+
+    def is_revoked(self, jti):
+        """
+        判断令牌是否已被吊销
+
+        :param jti: 令牌ID
+        :return: 结果
+        """
+        if self._refresher is None and time.monotonic() >= self._next_sync:
+            self._sync()
+        if jti not in self._filter:
+            return False
+        return self._store.contains(jti)
+
+    def close(self):
+        """
+        停止后台同步线程
+        """
+        refresher, self._refresher = self._refresher, None
+        if refresher is not None:
+            refresher.stop()
+
+    def _sync(self, force=False):
+        # 其他线程正在同步时不等待, 直接使用当前的过滤器
+        if not self._sync_lock.acquire(blocking=force):
+            return
+        try:
+            now = time.monotonic()
+            if now >= self._next_rebuild:
+                self._rebuild()
+                self._next_rebuild = now + self._rebuild_interval
+            else:
+                entries, cursor = self._store.entries_since(self._cursor)
+                with self._filter_lock:
+                    for jti, _ in entries:
+                        self._filter.add(jti)
+                self._cursor = cursor
+            self._next_sync = now + self._sync_interval
+        finally:
+            self._sync_lock.release()
+
+    def _rebuild(self):
+        self._store.purge_expired()
+        entries, cursor = self._store.entries_since(0)
+        now = time.time()
+        entries = [jti for jti, exp in entries if exp is None or exp > now]
+
+        capacity = max(self._capacity, len(entries) * 2)
+        bloom_filter = lang.BloomFilter(capacity, self._error_rate)
+        for jti in entries:
+            bloom_filter.add(jti)
+
+        # 重建期间新吊销的令牌已经写入存储, 持有锁再增量同步一次后替换;
+        # 之后本进程吊销的令牌直接加入新的过滤器
+        with self._filter_lock:
+            entries, cursor = self._store.entries_since(cursor)
+            for jti, _ in entries:
+                bloom_filter.add(jti)
+            self._filter = bloom_filter
+            self._cursor = cursor
+
+
+class _RevocationListRefresher(threading.Thread):
+
+    def __init__(self, revocation_list, interval):
+        super().__init__(name='jti-revocation-refresher', daemon=True)
+        self._revocation_list = revocation_list
+        self._interval = interval
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            # noinspection PyBroadException
+            try:
+                self._revocation_list._sync()
+            except Exception:
+                # 同步失败时保留原有的过滤器, 等待下一次同步
+                logging.exception('Cannot sync the jti revocation list.')
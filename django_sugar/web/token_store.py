@@ -0,0 +1,513 @@
+r"""
+ ____  _                           ____
+|  _ \(_) __ _ _ __   __ _  ___   / ___| _   _  __ _  __ _ _ __
+| | | | |/ _` | '_ \ / _` |/ _ \  \___ \| | | |/ _` |/ _` | '__|
+| |_| | | (_| | | | | (_| | (_) |  ___) | |_| | (_| | (_| | |
+|____// |\__,_|_| |_|\__, |\___/  |____/ \__,_|\__, |\__,_|_|
+    |__/             |___/                     |___/
+
+    https://github.com/yingzhuo/django-sugar
+
+"""
+import hashlib
+import json
+import logging
+import queue
+import sqlite3
+import string
+import threading
+import time
+
+from django_sugar import lang
+from django_sugar.web import token
+
+
+class OpaqueTokenStore(object):
+    """
+    服务端不透明令牌存储
+
+    令牌 -> 值 (通常为用户ID) 的进程内映射, 按令牌摘要分片, 每个分片一把锁,
+    多个线程可以并发查询不同分片。
+    内存中只保存令牌的SHA-256摘要, 不保存令牌原文。
+
+    过期的令牌由每个分片上的分层时间轮回收, 插入与回收都是O(1)的;
+    时间轮在访问分片时按需推进, 不需要后台线程。
+    """
+
+    def __init__(self, *, ttl=3600, sliding=False, num_shards=16, tick=1.0, persistence=None, clock=time.time):
+        """
+        构造方法
+
+        :param ttl: 令牌默认的存活时间 (秒)
+        :param sliding: 是否为滑动过期, 为True时每次成功查询都会将过期时间顺延ttl秒
+        :param num_shards: 分片数
+        :param tick: 时间轮的精度 (秒)
+        :param persistence: 持久化组件 (例如SQLiteTokenStorePersistence实例), None表示只保存在内存中
+        :param clock: 时钟函数, 返回UNIX时间戳
+        """
+        if ttl <= 0:
+            raise ValueError('ttl must be positive.')
+        if num_shards < 1:
+            raise ValueError('num_shards must be positive.')
+
+        self.ttl = ttl
+        self.sliding = sliding
+        self._tick = tick
+        self._clock = clock
+        self._persistence = persistence
+        now_tick = self._to_tick(clock())
+        self._shards = [_Shard(now_tick) for _ in range(num_shards)]
+
+        if persistence is not None:
+            self._load(persistence.load(clock()))
+
+    def _to_tick(self, timestamp):
+        return int(timestamp / self._tick)
+
+    def _get_shard(self, key):
+        return self._shards[int.from_bytes(key[:4], 'little') % len(self._shards)]
+
+    def _load(self, rows):
+        for key, value, expires_at, ttl in rows:
+            entry = _Entry(key, value, expires_at, ttl)
+            self._get_shard(key).insert(entry, self._to_tick(expires_at))
+
+    def put(self, token_value, value, *, ttl=None):
+        """
+        保存令牌
+
+        :param token_value: 令牌
+        :param value: 令牌对应的值, 启用持久化时必须可以序列化为JSON
+        :param ttl: 存活时间 (秒), 默认为构造时指定的ttl
+        """
+        ttl = ttl or self.ttl
+        now = self._clock()
+        key = _token_key(token_value)
+        entry = _Entry(key, value, now + ttl, ttl)
+
+        shard = self._get_shard(key)
+        with shard.lock:
+            shard.advance(self._to_tick(now), now, self._tick)
+            shard.insert(entry, self._to_tick(entry.expires_at))
+
+        if self._persistence is not None:
+            self._persistence.submit(('put', key, value, entry.expires_at, ttl))
+
+    def get(self, token_value, default=None):
+        """
+        查询令牌
+
+        :param token_value: 令牌
+        :param default: 令牌不存在或已过期时的返回值
+        :return: 令牌对应的值
+        """
+        now = self._clock()
+        key = _token_key(token_value)
+        shard = self._get_shard(key)
+        touched = None
+
+        with shard.lock:
+            shard.advance(self._to_tick(now), now, self._tick)
+            entry = shard.entries.get(key)
+            if entry is None:
+                return default
+            if entry.expires_at <= now:
+                del shard.entries[key]
+                return default
+            if self.sliding:
+                entry.expires_at = now + entry.ttl
+                # 时间轮中的位置不移动, 到期时发现过期时间已被顺延再重新插入
+                # 持久化的过期时间落后超过ttl的十分之一时才写入, 减少写入次数
+                if entry.expires_at - entry.persisted_expires_at > max(self._tick, entry.ttl / 10):
+                    entry.persisted_expires_at = touched = entry.expires_at
+            value = entry.value
+
+        if touched is not None and self._persistence is not None:
+            self._persistence.submit(('touch', key, touched))
+        return value
+
+    def delete(self, token_value):
+        """
+        删除 (吊销) 令牌
+
+        :param token_value: 令牌
+        :return: 令牌是否存在
+        """
+        key = _token_key(token_value)
+        shard = self._get_shard(key)
+        with shard.lock:
+            # 时间轮中的条目在到期时被丢弃
+            existed = shard.entries.pop(key, None) is not None
+
+        if self._persistence is not None:
+            self._persistence.submit(('delete', key))
+        return existed
+
+    def __contains__(self, token_value):
+        return self.get(token_value, _MISSING) is not _MISSING
+
+    def __len__(self):
+        # 包括已过期但尚未回收的令牌
+        return sum(len(x.entries) for x in self._shards)
+
+    def expire(self):
+        """
+        推进所有分片的时间轮, 回收已过期的令牌
+
+        :return: 回收的令牌个数
+        """
+        now = self._clock()
+        now_tick = self._to_tick(now)
+        ret = 0
+        for shard in self._shards:
+            with shard.lock:
+                ret += shard.advance(now_tick, now, self._tick)
+        return ret
+
+    def close(self):
+        """
+        关闭持久化组件, 等待尚未写入的数据写入完成
+        """
+        if self._persistence is not None:
+            self._persistence.close()
+
+
+_MISSING = object()
+
+
+def _token_key(token_value):
+    return hashlib.sha256(lang.ensure_bytes(token_value)).digest()
+
+
+class _Entry(object):
+    __slots__ = ('key', 'value', 'expires_at', 'persisted_expires_at', 'ttl')
+
+    def __init__(self, key, value, expires_at, ttl):
+        self.key = key
+        self.value = value
+        self.expires_at = expires_at
+        self.persisted_expires_at = expires_at
+        self.ttl = ttl
+
+
+class _Shard(object):
+
+    def __init__(self, now_tick):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.wheel = _TimingWheel(now_tick)
+
+    def insert(self, entry, expires_tick):
+        self.entries[entry.key] = entry
+        self.wheel.schedule(entry, expires_tick)
+
+    def advance(self, now_tick, now, tick):
+        """
+        推进时间轮, 必须持有锁
+
+        :return: 回收的令牌个数
+        """
+        if now_tick <= self.wheel.current_tick:
+            return 0
+
+        ret = 0
+        entries = self.entries
+        for entry in self.wheel.advance(now_tick):
+            if entries.get(entry.key) is not entry:
+                # 已被删除或被覆盖
+                continue
+            if entry.expires_at <= now:
+                del entries[entry.key]
+                ret += 1
+            else:
+                # 滑动过期顺延了过期时间
+                self.wheel.schedule(entry, int(entry.expires_at / tick))
+        return ret
+
+
+class _TimingWheel(object):
+    """
+    分层时间轮
+
+    每层64个槽, 第0层每槽为1个tick, 第n层每槽为64^n个tick。
+    超出最高层范围的条目先放在最远的槽中, 到期时再重新插入。
+    """
+
+    _BITS = 6
+    _SIZE = 1 << _BITS
+    _MASK = _SIZE - 1
+    _LEVELS = 4
+
+    def __init__(self, now_tick):
+        self.current_tick = now_tick
+        self._slots = [[[] for _ in range(self._SIZE)] for _ in range(self._LEVELS)]
+        self._counts = [0] * self._LEVELS
+
+    def schedule(self, item, expires_tick):
+        # 当前tick的槽已经处理过了, 最早只能放到下一个tick
+        self._place(item, max(expires_tick, self.current_tick + 1))
+
+    def _place(self, item, expires_tick):
+        current_tick = self.current_tick
+        delta = expires_tick - current_tick
+        if delta >> (self._BITS * self._LEVELS):
+            delta = (1 << (self._BITS * self._LEVELS)) - 1
+            expires_tick = current_tick + delta
+
+        level = 0
+        while level < self._LEVELS - 1 and delta >> (self._BITS * (level + 1)):
+            level += 1
+
+        self._slots[level][(expires_tick >> (self._BITS * level)) & self._MASK].append((expires_tick, item))
+        self._counts[level] += 1
+
+    def advance(self, now_tick):
+        """
+        推进到now_tick
+
+        :return: 到期的条目列表
+        """
+        ret = []
+        counts = self._counts
+
+        while self.current_tick < now_tick:
+            if not any(counts):
+                self.current_tick = now_tick
+                break
+
+            # 低层为空时直接跳到下一个需要重新分配的边界之前
+            level = 0
+            while level < self._LEVELS - 1 and not counts[level]:
+                level += 1
+            if level:
+                span = 1 << (self._BITS * level)
+                self.current_tick = min((self.current_tick // span + 1) * span - 1, now_tick)
+                if self.current_tick == now_tick:
+                    break
+
+            self.current_tick = t = self.current_tick + 1
+
+            # 跨过高层槽的边界时, 将其中的条目重新分配到低层
+            if not t & self._MASK:
+                level = 1
+                while level < self._LEVELS - 1 and not (t >> (self._BITS * level)) & self._MASK:
+                    level += 1
+                for lv in range(level, 0, -1):
+                    self._cascade(lv, (t >> (self._BITS * lv)) & self._MASK)
+
+            index = t & self._MASK
+            slot = self._slots[0][index]
+            if slot:
+                self._slots[0][index] = []
+                counts[0] -= len(slot)
+                ret.extend(item for _, item in slot)
+        return ret
+
+    def _cascade(self, level, index):
+        slot = self._slots[level][index]
+        if not slot:
+            return
+        self._slots[level][index] = []
+        self._counts[level] -= len(slot)
+        for expires_tick, item in slot:
+            self._place(item, expires_tick)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class SQLiteTokenStorePersistence(object):
+    """
+    OpaqueTokenStore的SQLite持久化组件
+
+    写入操作放入队列, 由后台线程批量写入本地SQLite文件 (write-behind), 不阻塞请求线程。
+    进程重启时从文件中加载尚未过期的令牌。
+    进程崩溃时, 队列中尚未写入的数据会丢失。
+    """
+
+    def __init__(self, path, *, table_name='opaque_token', batch_size=500, purge_interval=600):
+        """
+        构造方法
+
+        :param path: SQLite文件路径
+        :param table_name: 表名
+        :param batch_size: 每个事务最多写入的操作数
+        :param purge_interval: 删除过期记录的间隔 (秒)
+        """
+        self._path = path
+        self._table_name = table_name
+        self._batch_size = batch_size
+        self._purge_interval = purge_interval
+        self._queue = queue.Queue()
+
+        with sqlite3.connect(path, timeout=30) as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS %s ('
+                         'token_key BLOB PRIMARY KEY, '
+                         'value TEXT NOT NULL, '
+                         'expires_at REAL NOT NULL, '
+                         'ttl REAL NOT NULL)' % table_name)
+        conn.close()
+
+        self._writer = threading.Thread(target=self._run, name='opaque-token-writer', daemon=True)
+        self._writer.start()
+
+    def load(self, now):
+        """
+        加载尚未过期的令牌
+
+        :param now: 当前时间 (UNIX时间戳)
+        :return: 列表 [(令牌摘要, 值, 过期时间, ttl), ...]
+        """
+        conn = sqlite3.connect(self._path, timeout=30)
+        try:
+            sql = 'SELECT token_key, value, expires_at, ttl FROM %s WHERE expires_at > ?' % self._table_name
+            return [(bytes(k), json.loads(v), e, t) for k, v, e, t in conn.execute(sql, (now,))]
+        finally:
+            conn.close()
+
+    def submit(self, operation):
+        """
+        提交写入操作
+
+        :param operation: ('put', 令牌摘要, 值, 过期时间, ttl) / ('touch', 令牌摘要, 过期时间) / ('delete', 令牌摘要)
+        """
+        if operation[0] == 'put':
+            # 在请求线程中序列化, 值不能序列化时立即报错
+            operation = operation[:2] + (json.dumps(operation[2]),) + operation[3:]
+        self._queue.put(operation)
+
+    def flush(self):
+        """
+        等待队列中的操作全部写入
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        写入队列中剩余的操作并停止后台线程
+        """
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def _run(self):
+        conn = sqlite3.connect(self._path, timeout=30)
+        next_purge = time.monotonic() + self._purge_interval
+        try:
+            while True:
+                try:
+                    batch = [self._queue.get(timeout=min(self._purge_interval, 60))]
+                except queue.Empty:
+                    batch = []
+                while batch and batch[-1] is not None and len(batch) < self._batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                stopped = bool(batch) and batch[-1] is None
+                operations = batch[:-1] if stopped else batch
+                # noinspection PyBroadException
+                try:
+                    if operations:
+                        self._write(conn, operations)
+                    if time.monotonic() >= next_purge:
+                        with conn:
+                            conn.execute('DELETE FROM %s WHERE expires_at <= ?' % self._table_name, (time.time(),))
+                        next_purge = time.monotonic() + self._purge_interval
+                except Exception:
+                    logging.exception("Cannot write opaque tokens to '%s'.", self._path)
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+
+                if stopped:
+                    return
+        finally:
+            conn.close()
+
+    def _write(self, conn, operations):
+        table_name = self._table_name
+        with conn:
+            for operation in operations:
+                action = operation[0]
+                if action == 'put':
+                    conn.execute('INSERT OR REPLACE INTO %s (token_key, value, expires_at, ttl) '
+                                 'VALUES (?, ?, ?, ?)' % table_name, operation[1:])
+                elif action == 'touch':
+                    conn.execute('UPDATE %s SET expires_at = ? WHERE token_key = ?' % table_name,
+                                 (operation[2], operation[1]))
+                elif action == 'delete':
+                    conn.execute('DELETE FROM %s WHERE token_key = ?' % table_name, (operation[1],))
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+class OpaqueTokenBasedUserFinder(token.TokenBasedUserFinder):
+    """
+    通过不透明令牌获取用户实例的组件
+
+    从opaque_token_store中查询令牌对应的值, 有convert_user钩子方法时返回其转换的结果, 例如:
+
+    class MyAuthenticator(TokenBasedAuthenticator, BearerTokenResolver, OpaqueTokenBasedUserFinder):
+        opaque_token_store = OpaqueTokenStore(ttl=7200, sliding=True)
+
+        def convert_user(self, user_id):
+            return User.objects.filter(pk=user_id).first()
+    """
+
+    # 令牌存储 (OpaqueTokenStore实例)
+    opaque_token_store = None
+
+    def get_user_by_token(self, current_token, **kwargs):
+        if not current_token:
+            return None
+
+        value = self.opaque_token_store.get(current_token)
+        if value is None:
+            return None
+
+        convert_user = lang.get_callable_attr(self, 'convert_user', raise_error=False)
+        if convert_user:
+            return convert_user(value)
+        return value
+
+
+class OpaqueTokenGenerator(token.TokenGenerator):
+    """
+    不透明令牌生成器
+
+    生成密码学安全的随机字符串作为令牌, 并保存到opaque_token_store中。
+    """
+
+    # 令牌存储 (OpaqueTokenStore实例)
+    opaque_token_store = None
+
+    # 令牌长度
+    token_length = 40
+
+    # 令牌字符集
+    token_chars = string.ascii_letters + string.digits
+
+    # 令牌存活时间 (秒), None表示使用令牌存储的默认值
+    token_ttl = None
+
+    def get_token_value(self, user):
+        """
+        获取令牌对应的值
+
+        :param user: 用户对象
+        :return: 值, 默认为用户的主键
+        """
+        return user.pk
+
+    def generate_token(self, user, **kwargs):
+        token_value = lang.random_string(self.token_length, chars=self.token_chars)
+        self.opaque_token_store.put(token_value, self.get_token_value(user), ttl=self.token_ttl)
+        return token_value
+
+    def generate_tokens(self, users, **kwargs):
+        users = list(users)
+        ret = lang.random_strings(len(users), self.token_length, self.token_chars)
+        for token_value, user in zip(ret, users):
+            self.opaque_token_store.put(token_value, self.get_token_value(user), ttl=self.token_ttl)
+        return ret
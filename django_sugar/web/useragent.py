@@ -0,0 +1,239 @@
+r"""
+ ____  _                           ____
+|  _ \(_) __ _ _ __   __ _  ___   / ___| _   _  __ _  __ _ _ __
+| | | | |/ _` | '_ \ / _` |/ _ \  \___ \| | | |/ _` |/ _` | '__|
+| |_| | | (_| | | | | (_| | (_) |  ___) | |_| | (_| | (_| | |
+|____// |\__,_|_| |_|\__, |\___/  |____/ \__,_|\__, |\__,_|_|
+    |__/             |___/                     |___/
+
+    https://github.com/yingzhuo/django-sugar
+
+"""
+import threading
+
+from django.utils import deprecation
+
+from django_sugar import lang
+
+# 分类
+SEARCH_BOT = 'search_bot'
+SEO_CRAWLER = 'seo_crawler'
+MONITORING = 'monitoring'
+HEADLESS_BROWSER = 'headless_browser'
+
+# 缺省的模式串, 格式与模式串文件相同
+# 匹配时忽略大小写, 只要User-Agent中包含模式串即属于对应的分类
+DEFAULT_USER_AGENT_PATTERNS = """
+[search_bot]
+Googlebot
+Googlebot-Mobile
+Googlebot-Image
+Mediapartners-Google
+AdsBot-Google
+Feedfetcher-Google
+Google-InspectionTool
+bingbot
+msnbot
+BingPreview
+Baiduspider
+YandexBot
+Yahoo! Slurp
+DuckDuckBot
+Applebot
+Sogou web spider
+Sogou spider
+Sosospider
+YoudaoBot
+360Spider
+qihoobot
+Bytespider
+PetalBot
+Yeti
+SeznamBot
+Exabot
+ia_archiver
+Tomato Bot
+
+[seo_crawler]
+AhrefsBot
+SemrushBot
+MJ12bot
+DotBot
+rogerbot
+BLEXBot
+SEOkicks
+Screaming Frog SEO Spider
+serpstatbot
+DataForSeoBot
+Barkrowler
+MegaIndex
+LinkpadBot
+SiteAuditBot
+
+[monitoring]
+UptimeRobot
+Pingdom
+StatusCake
+Site24x7
+NewRelicPinger
+Datadog/Synthetics
+ELB-HealthChecker
+GoogleHC
+kube-probe
+Prometheus
+Zabbix
+Nagios
+check_http
+Better Uptime Bot
+Uptime-Kuma
+Checkly
+
+[headless_browser]
+HeadlessChrome
+PhantomJS
+SlimerJS
+Puppeteer
+Playwright
+Selenium
+"""
+
+
+def parse_user_agent_patterns(text):
+    """
+    解析模式串文本
+
+    格式:
+        [分类名称]
+        模式串
+        ...
+
+    每行一个模式串, 首尾空白会被忽略; 空行与以#开头的行会被忽略。
+
+    :param text: 文本
+    :return: 字典, 分类名称 -> 模式串列表
+    """
+    ret = {}
+    category = None
+    for number, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            category = line[1:-1].strip()
+            ret.setdefault(category, [])
+            continue
+        if category is None:
+            raise ValueError('line %d: pattern outside of a [category] section.' % number)
+        ret[category].append(line)
+    return ret
+
+
+class UserAgentClassifier(object):
+    """
+    User-Agent分类器
+
+    所有分类的模式串构建为一个Aho-Corasick自动机, 扫描一遍User-Agent即可得到全部分类。
+    真实流量中的User-Agent种类很少, 前端的LRU缓存可以命中绝大多数请求。
+    """
+
+    def __init__(self, patterns=None, *, cache_size=4096, max_cached_length=512):
+        """
+        构造方法
+
+        :param patterns: 字典, 分类名称 -> 模式串列表; 默认为DEFAULT_USER_AGENT_PATTERNS
+        :param cache_size: LRU缓存的条目数
+        :param max_cached_length: 超过此长度的User-Agent不缓存, 避免恶意的超长User-Agent占用内存
+        """
+        if patterns is None:
+            patterns = parse_user_agent_patterns(DEFAULT_USER_AGENT_PATTERNS)
+
+        self._automaton = lang.AhoCorasick()
+        for category, category_patterns in patterns.items():
+            for pattern in category_patterns:
+                self._automaton.add(pattern, category)
+        self._automaton.build()
+
+        self.categories = frozenset(patterns)
+        self._cache = lang.LRUCache(cache_size)
+        self._max_cached_length = max_cached_length
+
+    @classmethod
+    def from_file(cls, path, *, encoding='utf-8', **kwargs):
+        """
+        从模式串文件创建分类器
+
+        :param path: 文件路径, 格式见parse_user_agent_patterns
+        :param encoding: 文件编码
+        :param kwargs: 构造方法的其他参数
+        :return: UserAgentClassifier实例
+        """
+        with open(path, 'r', encoding=encoding) as f:
+            return cls(parse_user_agent_patterns(f.read()), **kwargs)
+
+    def classify(self, user_agent):
+        """
+        对User-Agent分类
+
+        :param user_agent: User-Agent
+        :return: 分类名称的集合 (frozenset), 不属于任何分类时为空集合
+        """
+        if not user_agent:
+            return frozenset()
+
+        if len(user_agent) > self._max_cached_length:
+            return frozenset(self._automaton.find_values(user_agent))
+
+        ret = self._cache.get(user_agent)
+        if ret is None:
+            ret = frozenset(self._automaton.find_values(user_agent))
+            self._cache.set(user_agent, ret)
+        return ret
+
+    def is_bot(self, user_agent):
+        """
+        判断User-Agent是否属于任意一个分类
+
+        :param user_agent: User-Agent
+        :return: 结果
+        """
+        return bool(self.classify(user_agent))
+
+    @property
+    def cache_stats(self):
+        return self._cache.stats
+
+
+_default_classifier = None
+_default_classifier_lock = threading.Lock()
+
+
+def get_default_user_agent_classifier():
+    """
+    获取使用缺省模式串的分类器 (单例)
+
+    :return: UserAgentClassifier实例
+    """
+    global _default_classifier
+    if _default_classifier is None:
+        with _default_classifier_lock:
+            if _default_classifier is None:
+                _default_classifier = UserAgentClassifier()
+    return _default_classifier
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class UserAgentClassifierMiddleware(deprecation.MiddlewareMixin):
+    """
+    User-Agent分类中间件
+
+    为每个请求设置user_agent_categories属性 (分类名称的集合)。
+    """
+
+    # 分类器, 为None时使用缺省的分类器
+    user_agent_classifier = None
+
+    def process_request(self, request):
+        classifier = self.user_agent_classifier or get_default_user_agent_classifier()
+        request.user_agent_categories = classifier.classify(request.headers.get('User-Agent', None))